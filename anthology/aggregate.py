@@ -1,110 +1,403 @@
 """Just for fun implementation of parallel distributable aggregate workflow
 with Luigi. This would be calculating sums in mongo gluster, hadoop or similar
-etc."""
+etc.
 
+Workflow is incremental. Songs data is expected to be append only file and
+the byte offset up to which it has been processed is stored as watermark of
+the source. Each run processes only songs added after the watermark and adds
+them to the stored totals of each level found from the new songs.
+
+"""
+
+import os
+import shutil
 import logging
+from hashlib import sha1
 
-from json import loads
+from json import loads, dumps
 
 import luigi
 import luigi.contrib.mongodb
+from pymongo.errors import DuplicateKeyError
 import luigi.scheduler
 import luigi.worker
 
 # tests will monkeypatch database, so we use direct import
+import anthology.cache
+import anthology.chunks
 import anthology.database
+import anthology.stats
 
 logging.basicConfig(loglevel=logging.DEBUG)
 
+DEFAULT_SOURCE = 'tests/data/songs.json'
+
+
+def source_key(filename):
+    """Return key identifying given source file in watermarks"""
+    return sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16]
+
+
+def source_watermark(filename):
+    """Return byte offset up to which source file has been processed"""
+    result = anthology.database.db_averages().find_one(
+        {'_id': 'source:%s' % source_key(filename)})
+    return result['watermark'] if result else 0
+
+
+def advance_source(filename, end):
+    """Mark source file processed up to given byte offset"""
+    anthology.database.db_averages().update_one(
+        {'_id': 'source:%s' % source_key(filename)},
+        {'$max': {'watermark': end}, '$set': {'source': filename}},
+        upsert=True)
+
+
+def level_watermarks(filename):
+    """Return watermarks of given source for each level"""
+    key = 'watermarks.%s' % source_key(filename)
+    return dict(
+        (total['level'], total['watermarks'][source_key(filename)])
+        for total in anthology.database.db_averages().find(
+            {key: {'$exists': True}}, {'level': True, key: True}))
+
+
+def pending_range(filename):
+    """Return byte range of the source which should be processed next.
+
+    If previous run was interrupted after some levels were updated, the same
+    range is processed again, and already updated levels are skipped.
+
+    :filename: Path to songs data
+    :returns: Tuple `(start, end)`
+
+    """
+    start = source_watermark(filename)
+    interrupted = max(level_watermarks(filename).values() or [0])
+    if interrupted > start:
+        return start, interrupted
+
+    end = anthology.chunks.data_end(filename)
+    if end < start:
+        raise ValueError(
+            "Source %s is shorter than processed, it must be append only" %
+            filename)
+    return start, end
+
+
+def totals_update(filename, level, total, partial, end):
+    """Return update merging partial statistics to totals of a level.
+
+    Update is conditional on the watermark of the source which was read with
+    the totals, so the same songs are never added twice. Totals stored before
+    watermarks were introduced can not tell which songs they include, so they
+    are replaced instead of merged.
+
+    :filename: Path to songs data
+    :level: Song level
+    :total: Current totals document of the level or empty dictionary
+    :partial: Statistics of the new songs, see `anthology.stats`
+    :end: New watermark of the source
+    :returns: Tuple `(filter, update, upsert)`
+
+    """
+    key = source_key(filename)
+    legacy = bool(total) and 'watermarks' not in total
+    watermark = total.get('watermarks', {}).get(key, 0)
+    stats = partial if legacy else anthology.stats.merge(
+        total.get('stats') or anthology.stats.empty(), partial)
+
+    key = 'watermarks.%s' % key
+
+    if legacy:
+        condition = {'_id': level, 'watermarks': {'$exists': False}}
+    elif watermark:
+        condition = {'_id': level, key: watermark}
+    else:
+        condition = {'_id': level, key: {'$exists': False}}
+
+    update = {'$set': {
+        'level': level,
+        key: end,
+        'stats': stats,
+        'total_difficulty': anthology.stats.total(stats),
+        'number_of_songs': stats['count']}}
+
+    return condition, update, not watermark and not legacy
+
+
+def check_applied(filename, levels, end):
+    """Raise error unless totals of given levels include the source up to end.
+
+    Used when conditional update of totals did not apply, for example when
+    other process inserted the same level first and upsert failed with
+    duplicate key error. If the other process added the same range, the
+    update is already applied.
+
+    :filename: Path to songs data
+    :levels: Iterable of levels which were not updated
+    :end: Watermark which the update would have set
+    :returns: None
+
+    """
+    watermarks = level_watermarks(filename)
+    changed = [level for level in levels if watermarks.get(level, 0) < end]
+    if changed:
+        raise RuntimeError(
+            "Totals of levels %s were changed by other process" %
+            ', '.join(str(level) for level in sorted(changed)))
+
 
 class SongsData(luigi.ExternalTask):
     """Check that input file created by some other process exists"""
 
-    filename = luigi.Parameter(default='tests/data/songs.json')
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
 
     def output(self):
         """Return our source file"""
         return luigi.LocalTarget(self.filename)
 
 
+class PartitionChunk(luigi.Task):
+    """Split byte range of songs data to shards by level.
+
+    Source is read and decoded only once for all levels, and chunks of the
+    file are partitioned in parallel. Levels are discovered from the data and
+    listed in the output of the task.
+
+    """
+
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
+    start = luigi.IntParameter()
+    end = luigi.IntParameter()
+
+    def shard(self, level):
+        """Return target for songs of given level"""
+        return luigi.LocalTarget('tmp/songs_%s.%s-%s.chunk_level_%s.json' % (
+            source_key(self.filename), self.start, self.end, level))
+
+    def output(self):
+        """List of levels found from the chunk"""
+        return luigi.LocalTarget('tmp/songs_%s.%s-%s.levels.json' % (
+            source_key(self.filename), self.start, self.end))
+
+    def requires(self):
+        """Requires songs data"""
+        return SongsData(self.filename)
+
+    def run(self):
+        """Write songs of the byte range to shard of each level.
+
+        Luigi targets are written to temporary files and moved in place when
+        closed, so shards are never left partially written if this fails.
+        List of levels is written last.
+
+        """
+        outputs = {}
+
+        for song_json in anthology.chunks.read_lines(
+                self.input().path, self.start, self.end):
+            song = loads(song_json)
+            if song["level"] not in outputs:
+                outputs[song["level"]] = self.shard(song["level"]).open('w')
+            outputs[song["level"]].write(song_json)
+
+        for outfile in outputs.values():
+            outfile.close()
+
+        with self.output().open('w') as outfile:
+            outfile.write(dumps(sorted(outputs)))
+
+
+def chunk_tasks(filename, start, end, chunks):
+    """Return partition tasks for given byte range"""
+    return [
+        PartitionChunk(filename=filename, start=chunk_start, end=chunk_end)
+        for chunk_start, chunk_end in anthology.chunks.chunk_ranges(
+            start, end, chunks)]
+
+
 class SongsByLevel(luigi.Task):
     """Since our source data is in single file, we just simulate here that we
     would get each level from different data set.
     """
 
     level = luigi.IntParameter()
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
+    start = luigi.IntParameter()
+    end = luigi.IntParameter()
+    chunks = luigi.IntParameter(default=4)
 
     def output(self):
         """Output target"""
-        return luigi.LocalTarget('tmp/songs_by_level_%s.json' % self.level)
+        return luigi.LocalTarget('tmp/songs_by_level_%s.%s.%s-%s.json' % (
+            self.level, source_key(self.filename), self.start, self.end))
 
     def requires(self):
-        """Requires songs data"""
-        return SongsData()
+        """Requires all partitioned chunks of the byte range"""
+        return chunk_tasks(self.filename, self.start, self.end, self.chunks)
 
     def run(self):
-        """Write songs by level to our target file"""
+        """Concatenate level shards of all chunks to our target file"""
         with self.output().open('w') as outfile:
-            for song_json in self.input().open():
-                song = loads(song_json)
-                if song["level"] == self.level:
-                    outfile.write(song_json)
+            for chunk, levels in zip(self.requires(), self.input()):
+                with levels.open('r') as infile:
+                    if self.level not in loads(infile.read()):
+                        continue
+                with chunk.shard(self.level).open('r') as infile:
+                    shutil.copyfileobj(infile, outfile)
 
 
 class CalculateTotalDifficulty(luigi.Task):
-    """Calculate averages for given level"""
+    """Add songs of the byte range to totals of given level"""
 
     level = luigi.IntParameter()
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
+    start = luigi.IntParameter()
+    end = luigi.IntParameter()
+    chunks = luigi.IntParameter(default=4)
 
     def requires(self):
         """Requires songs data for given leven"""
-        return SongsByLevel(self.level)
+        return SongsByLevel(
+            level=self.level, filename=self.filename, start=self.start,
+            end=self.end, chunks=self.chunks)
+
+    def watermark(self):
+        """Return watermark of the source in totals of our level"""
+        return level_watermarks(self.filename).get(self.level, 0)
 
     def run(self):
-        """Write averages to database"""
+        """Merge statistics of new songs to statistics in database.
 
-        total_difficulty = 0
-        number_of_songs = 0
+        Statistics are updated only if level watermark has not changed since
+        they were read, so the same songs are never added twice.
 
-        for song_json in self.input().open():
-            song = loads(song_json)
-            number_of_songs += 1
-            total_difficulty += song["difficulty"]
+        """
+
+        key = source_key(self.filename)
+        total = anthology.database.db_averages().find_one(
+            {'_id': self.level}) or {}
+        watermark = total.get('watermarks', {}).get(key, 0)
+
+        if watermark >= self.end:
+            return
+        if watermark > self.start:
+            raise RuntimeError(
+                "Totals of level %s are processed up to %s, but this range "
+                "starts from %s, recalculate averages" % (
+                    self.level, watermark, self.start))
 
-        anthology.database.db_averages().update(
-            {'_id': self.level},
-            {'_id': self.level,
-             'level': self.level,
-             'total_difficulty': total_difficulty,
-             'number_of_songs': number_of_songs},
-            upsert=True)
+        with self.input().open('r') as infile:
+            partial = anthology.stats.from_values(
+                loads(song_json)["difficulty"] for song_json in infile)
+
+        condition, update, upsert = totals_update(
+            self.filename, self.level, total, partial, self.end)
+
+        try:
+            result = anthology.database.db_averages().update_one(
+                condition, update, upsert=upsert)
+        except DuplicateKeyError:
+            # Other process inserted the level after we read it
+            result = None
+
+        if result is None or (
+                not result.matched_count and result.upserted_id is None):
+            check_applied(self.filename, [self.level], self.end)
+            return
+
+        anthology.database.data_changed()
 
     def complete(self):
-        """Return complete when given result exists"""
-        result = anthology.database.db_averages().find_one(
-            {'_id': self.level})
-        return result is not None
+        """Return complete when totals include the byte range"""
+        return self.watermark() >= self.end
+
+
+class FoldTotals(luigi.Task):
+    """Add songs of the byte range to totals of all levels found from it"""
+
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
+    start = luigi.IntParameter()
+    end = luigi.IntParameter()
+    chunks = luigi.IntParameter(default=4)
+
+    def requires(self):
+        """Requires all partitioned chunks of the byte range"""
+        return chunk_tasks(self.filename, self.start, self.end, self.chunks)
+
+    def run(self):
+        """Calculate totals for each level and move source watermark"""
+
+        levels = set()
+        for output in self.input():
+            with output.open('r') as infile:
+                levels.update(loads(infile.read()))
+
+        yield [
+            CalculateTotalDifficulty(
+                level=level, filename=self.filename, start=self.start,
+                end=self.end, chunks=self.chunks)
+            for level in sorted(levels)]
+
+        advance_source(self.filename, self.end)
+
+    def complete(self):
+        """Return complete when source has been processed up to the end"""
+        return source_watermark(self.filename) >= self.end
 
 
 class RunTotals(luigi.WrapperTask):
-    """Calculate difficulty averages for all levels"""
+    """Calculate difficulty totals for all songs added since the last run"""
+
+    filename = luigi.Parameter(default=DEFAULT_SOURCE)
+    chunks = luigi.IntParameter(default=4)
 
     def requires(self):
-        """Requires average calculation for each level"""
-        for level in range(0, 20):
-            yield CalculateTotalDifficulty(level)
+        """Requires totals for the unprocessed range of the source"""
+        start, end = pending_range(self.filename)
+        return FoldTotals(
+            filename=self.filename, start=start, end=end, chunks=self.chunks)
+
+
+def calculate_totals(filename=DEFAULT_SOURCE, chunks=4, engine='luigi'):
+    """Run the average workflow until all songs are processed.
+
+    :filename: Path to songs data
+    :chunks: Number of byte ranges processed in parallel
+    :engine: `luigi` for Luigi workflow or `pool` for in-process
+        multiprocessing pool, see `anthology.mapreduce`
+    :returns: None
+
+    """
+
+    if engine == 'pool':
+        # Imported here, since mapreduce depends on this module
+        import anthology.mapreduce
+        anthology.mapreduce.calculate_totals(filename, processes=chunks)
+        return
+
+    if engine != 'luigi':
+        raise ValueError("Unknown engine %r" % engine)
+
+    while True:
+        watermark = source_watermark(filename)
 
+        scheduler = luigi.scheduler.Scheduler()
+        worker = luigi.worker.Worker(scheduler=scheduler, worker_processes=5)
 
-def calculate_totals():
-    """Run the average workflow"""
+        averages = RunTotals(filename=filename, chunks=chunks)
+        if averages.complete():
+            break
 
-    scheduler = luigi.scheduler.Scheduler()
-    worker = luigi.worker.Worker(scheduler=scheduler, worker_processes=5)
+        with worker:
+            worker.add(averages)
+            worker.run()
 
-    averages = RunTotals()
+        print luigi.execution_summary.summary(worker)
 
-    with worker:
-        worker.add(averages)
-        worker.run()
+        if source_watermark(filename) == watermark:
+            break
 
-    print luigi.execution_summary.summary(worker)
+    # Tasks may run in worker processes with their own caches
+    anthology.cache.invalidate()
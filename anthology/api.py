@@ -3,26 +3,52 @@
 from flask import Flask
 from flask_restful import Api
 
-from anthology.songs import search, average, rating
+import anthology.cache
+import anthology.database
+import anthology.indexes
+import anthology.metrics
+import anthology.suggest
+from anthology.songs import search, average, rating, suggest
 
 
-def get_app():
+def get_app(config=None):
     """Configure main application.
 
+    :config: Dictionary with additional application settings
     :returns: Flask application object
     """
 
     app = Flask(__name__)
+    app.config.update(config or {})
+
+    anthology.database.configure(app.config)
+    anthology.cache.configure(
+        app.config, collection=anthology.database.db_cache)
+    metrics = anthology.metrics.install(app)
+    anthology.suggest.configure(app.config)
+
+    if app.config.get('ENSURE_INDEXES'):
+        anthology.indexes.ensure_indexes(
+            text_index=app.config.get('ENSURE_TEXT_INDEX', True))
+
     api = Api(app, catch_all_404s=True)
 
     api.add_resource(search.SongList, '/songs')
     api.add_resource(search.SongSearch, '/songs/search')
+    api.add_resource(search.SongExport, '/songs/export')
+    api.add_resource(search.SongBatch, '/songs/batch')
+    api.add_resource(suggest.Suggest, '/songs/suggest')
     api.add_resource(average.AverageDifficulty, '/songs/avg')
     api.add_resource(
         rating.Rating, '/songs/rating/<string:_id>', endpoint='song_rating')
+    api.add_resource(rating.Ratings, '/songs/ratings')
+    api.add_resource(rating.TopRated, '/songs/top-rated')
+
+    if metrics:
+        api.add_resource(anthology.metrics.Metrics, '/metrics')
 
     return app
 
 
 if __name__ == '__main__':
-    get_app().run(debug=True)
+    get_app({'ENSURE_INDEXES': True}).run(debug=True)
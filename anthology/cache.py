@@ -0,0 +1,247 @@
+"""Response cache for read only resources.
+
+Responses are cached by endpoint, normalized request parameters and version
+counter of songs data, which is stored in MongoDB and incremented on every
+write. Writes made by other processes, such as other API workers or import
+and aggregate commands, change the version, so their changes are seen
+without invalidating the caches of every process. Entries of old versions
+are never hit again and expire with the configured time to live.
+
+"""
+
+import time
+import threading
+import datetime
+from json import dumps, loads
+from functools import wraps
+from collections import OrderedDict
+
+from flask import g, request
+
+
+MISSING = object()
+
+
+class NullCache(object):
+    """Cache backend which never stores anything"""
+
+    def get(self, key):
+        """Return MISSING for all keys"""
+        # pylint: disable=no-self-use,unused-argument
+        return MISSING
+
+    def set(self, key, value):
+        """Ignore given value"""
+        pass
+
+    def clear(self):
+        """Nothing to clear"""
+        pass
+
+
+class LRUCache(object):
+    """In-process least recently used cache with time to live"""
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.time):
+        """Setup class
+
+        :maxsize: Maximum number of cached items
+        :ttl: Seconds to keep each item
+        :clock: Function returning current time in seconds
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Return cached value or MISSING"""
+        with self._lock:
+            try:
+                expires, value = self._items.pop(key)
+            except KeyError:
+                return MISSING
+            if expires < self.clock():
+                return MISSING
+            self._items[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        """Store value and remove least recently used items over maxsize"""
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (self.clock() + self.ttl, value)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """Remove all items"""
+        with self._lock:
+            self._items.clear()
+
+
+class MongoCache(object):
+    """Cache shared by all processes, stored in MongoDB collection.
+
+    Expired documents are removed by MongoDB TTL index.
+
+    """
+
+    def __init__(self, collection, ttl=60):
+        """Setup class
+
+        :collection: Function returning the cache collection
+        :ttl: Seconds to keep each item
+
+        """
+        self.collection = collection
+        self.ttl = ttl
+        self._indexed = False
+
+    def get(self, key):
+        """Return cached value or MISSING"""
+        document = self.collection().find_one(
+            {'_id': key, 'expires': {'$gt': datetime.datetime.utcnow()}})
+        if document is None:
+            return MISSING
+        return loads(document['value'], object_pairs_hook=OrderedDict)
+
+    def set(self, key, value):
+        """Store value as JSON"""
+        collection = self.collection()
+        if not self._indexed:
+            collection.create_index('expires', expireAfterSeconds=0)
+            self._indexed = True
+        expires = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=self.ttl)
+        collection.replace_one(
+            {'_id': key},
+            {'_id': key, 'value': dumps(value), 'expires': expires},
+            upsert=True)
+
+    def clear(self):
+        """Remove all items"""
+        self.collection().delete_many({})
+
+
+class ResponseCache(object):
+    """Count cache hits and misses for the configured backend"""
+
+    def __init__(self, backend):
+        """Setup class"""
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return cached value or MISSING"""
+        value = self.backend.get(key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store value to backend"""
+        self.backend.set(key, value)
+
+    def clear(self):
+        """Invalidate all cached responses"""
+        self.backend.clear()
+
+    def stats(self):
+        """Return dictionary with cache counters"""
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / float(requests) if requests else 0.0}
+
+
+CACHE = ResponseCache(LRUCache())
+
+
+def configure(config, collection=None):
+    """Select cache backend from application config.
+
+    `CACHE_BACKEND` is one of `memory` (default), `mongo` or `none`.
+    `CACHE_MAXSIZE` and `CACHE_TTL` configure size and time to live.
+
+    :config: Dictionary with settings
+    :collection: Function returning cache collection for `mongo` backend
+    :returns: None
+
+    """
+    backend = config.get('CACHE_BACKEND', 'memory')
+    ttl = config.get('CACHE_TTL', 60)
+
+    if backend == 'none':
+        CACHE.backend = NullCache()
+    elif backend == 'mongo':
+        CACHE.backend = MongoCache(collection, ttl=ttl)
+    elif backend == 'memory':
+        CACHE.backend = LRUCache(
+            maxsize=config.get('CACHE_MAXSIZE', 1024), ttl=ttl)
+    else:
+        raise ValueError("Unknown cache backend %s" % backend)
+
+
+def invalidate():
+    """Drop all cached responses of this process.
+
+    Cache keys include the data version, so this only frees memory of
+    entries which can't be hit anymore.
+
+    """
+    CACHE.clear()
+
+
+def stats():
+    """Return cache hit and miss counters"""
+    return CACHE.stats()
+
+
+def data_version():
+    """Return version of songs data for current request.
+
+    Version is read once for each request, so cache key and entity tag of
+    the response are based on the same version.
+
+    """
+    version = getattr(g, 'songs_version', None)
+    if version is None:
+        # Imported here, since database imports this module
+        import anthology.database
+        version = g.songs_version = anthology.database.songs_version()
+    return version
+
+
+def request_key():
+    """Return cache key for current request"""
+    args = sorted(
+        (key, value) for key, values in request.args.lists()
+        for value in values)
+    view_args = sorted((request.view_args or {}).items())
+    return dumps([request.endpoint, view_args, args])
+
+
+def cached(func):
+    """Decorator caching return value of resource method"""
+
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        """Return cached response or call resource method"""
+        key = '%s:%s' % (request_key(), data_version())
+        value = CACHE.get(key)
+        if value is MISSING:
+            value = func(*args, **kwargs)
+            CACHE.set(key, value)
+        return value
+
+    return _wrapper
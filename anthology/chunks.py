@@ -0,0 +1,74 @@
+"""Split line based files to byte ranges which can be processed in parallel.
+
+Each line belongs to the range where it starts, so lines are never split
+between ranges.
+
+"""
+
+import os
+
+
+def data_end(filename):
+    """Return offset after the last complete line of given file.
+
+    Trailing partial line may be still being written by other process, so
+    it is left for the next run.
+
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return 0
+
+    with open(filename, 'rb') as infile:
+        position = size
+        while position > 0:
+            start = max(0, position - 4096)
+            infile.seek(start)
+            block = infile.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+
+    return 0
+
+
+def chunk_ranges(start, end, chunks):
+    """Return list of `(start, end)` byte ranges splitting given range.
+
+    :start: Start offset
+    :end: End offset
+    :chunks: Number of ranges
+    :returns: List of non-empty ranges
+
+    """
+    chunks = max(1, chunks)
+    size = end - start
+    offsets = [start + size * index // chunks for index in range(chunks + 1)]
+    return [
+        (offsets[index], offsets[index + 1]) for index in range(chunks)
+        if offsets[index] < offsets[index + 1]]
+
+
+def read_lines(filename, start, end):
+    """Yield lines starting within given byte range.
+
+    :filename: Path to file
+    :start: Start offset
+    :end: End offset
+    :returns: Iterable of lines
+
+    """
+    with open(filename, 'rb') as infile:
+        if start > 0:
+            # Skip the line which started in previous range
+            infile.seek(start - 1)
+            infile.readline()
+        else:
+            infile.seek(0)
+
+        while infile.tell() < end:
+            line = infile.readline()
+            if not line:
+                break
+            yield line
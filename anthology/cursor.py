@@ -0,0 +1,35 @@
+"""Opaque cursor tokens for keyset pagination.
+
+Token encodes sort key values of the last returned item, so the next page
+can be queried directly from an index instead of skipping items.
+
+"""
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+from bson import json_util
+
+
+def encode(values):
+    """Return cursor token for given list of sort key values"""
+    return urlsafe_b64encode(json_util.dumps(values).encode('utf-8'))
+
+
+def decode(token):
+    """Return list of sort key values from cursor token.
+
+    This can be used as `reqparse` argument type.
+
+    :token: Token from `encode()`
+    :returns: List of values
+    :raises: ValueError for invalid tokens
+
+    """
+    try:
+        values = json_util.loads(
+            urlsafe_b64decode(str(token)).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor %s" % token)
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor %s" % token)
+    return values
@@ -1,7 +1,20 @@
 """MongoDB backend"""
 
-from pymongo import MongoClient, ASCENDING
-from bson import ObjectId
+import os
+import threading
+from fractions import Fraction
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo import UpdateOne, WriteConcern
+from pymongo.read_preferences import (
+    Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest)
+from bson import ObjectId, SON
+
+import anthology.cache
+import anthology.metrics
+import anthology.rollups
+import anthology.stats
+import anthology.trigrams
 
 
 class DatabaseError(Exception):
@@ -9,16 +22,135 @@ class DatabaseError(Exception):
     pass
 
 
+# Connection settings, these can be overridden from environment or Flask
+# application config with `configure()`
+SETTINGS = {
+    'MONGO_URI': 'mongodb://localhost:27017/',
+    'MONGO_MAX_POOL_SIZE': 100,
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': None,
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 30000,
+    'MONGO_MAX_STALENESS_SECONDS': None,
+    'MONGO_WRITE_CONCERN': None,
+    'MONGO_WRITE_TIMEOUT_MS': None
+}
+
+# Settings which are not converted to integers
+STRING_SETTINGS = ('MONGO_URI', 'MONGO_WRITE_CONCERN')
+
+# Read preference modes by name
+READ_MODES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+# Default read preference of query functions, other functions read from
+# primary. Responses of cached endpoints are cached and tagged with the data
+# version read from primary, so their queries must read from primary too,
+# otherwise lagging data would be cached as the new version. Only the
+# uncached export streams from secondaries.
+DEFAULT_READ_PREFERENCES = {
+    'export_songs': 'secondaryPreferred'
+}
+
+# Read preferences in use, these can be overridden with
+# `MONGO_READ_PREFERENCES` in application config
+READ_PREFERENCES = dict(DEFAULT_READ_PREFERENCES)
+
+# Client factory, tests may replace this with mongomock.MongoClient
+CLIENT_FACTORY = [MongoClient]
+
+# Process wide client instance and the pid of the process that created it
+_CLIENT = {'client': None, 'pid': None}
+_CLIENT_LOCK = threading.Lock()
+
+
+def configure(config=None):
+    """Update connection settings.
+
+    Settings are read first from environment variables prefixed with
+    `ANTHOLOGY_` (for example `ANTHOLOGY_MONGO_URI`) and then from given
+    `config`, which is usually Flask `app.config`. Read preferences of query
+    functions are updated from dictionary `MONGO_READ_PREFERENCES` in
+    `config`. Any existing client is closed and a new one created on next
+    `connection()` call.
+
+    :config: Dictionary with settings
+    :returns: None
+
+    """
+    for key, value in SETTINGS.items():
+        value = os.environ.get('ANTHOLOGY_%s' % key, value)
+        if config is not None:
+            value = config.get(key, value)
+        if value is not None and key not in STRING_SETTINGS:
+            value = int(value)
+        SETTINGS[key] = value
+
+    preferences = dict(DEFAULT_READ_PREFERENCES)
+    if config is not None:
+        preferences.update(config.get('MONGO_READ_PREFERENCES') or {})
+    for name, mode in preferences.items():
+        if mode not in READ_MODES:
+            raise ValueError("Unknown read preference %s for %s" % (
+                mode, name))
+    READ_PREFERENCES.clear()
+    READ_PREFERENCES.update(preferences)
+
+    reset_connection()
+
+
+def set_client_factory(factory):
+    """Replace the MongoClient class, used in tests to install mongomock.
+
+    :factory: Callable returning MongoClient compatible object
+    :returns: None
+
+    """
+    CLIENT_FACTORY[0] = factory
+    reset_connection()
+
+
+def reset_connection():
+    """Close and forget current client"""
+    client = _CLIENT['client']
+    if client is not None and _CLIENT['pid'] == os.getpid():
+        client.close()
+    _CLIENT['client'] = None
+    _CLIENT['pid'] = None
+
+
+def client_options():
+    """Return keyword arguments for the MongoClient"""
+    options = {
+        'maxPoolSize': SETTINGS['MONGO_MAX_POOL_SIZE'],
+        'serverSelectionTimeoutMS': SETTINGS[
+            'MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        'connect': False
+    }
+    if SETTINGS['MONGO_WAIT_QUEUE_TIMEOUT_MS'] is not None:
+        options['waitQueueTimeoutMS'] = SETTINGS['MONGO_WAIT_QUEUE_TIMEOUT_MS']
+    return options
+
+
 def connection():
     """Return MongoClient connection object.
 
-    pymongo.MongoClient has it's own instance caching/connection pool.
-
-    MongoMock however does not, so we will mockup this in tests and provide our
-    own instance cache.
+    Single client with it's own connection pool is shared by the whole
+    process. Client is created lazily on first call and created again after
+    fork, since pymongo clients are not fork safe.
 
     """
-    return MongoClient()
+    pid = os.getpid()
+    if _CLIENT['client'] is None or _CLIENT['pid'] != pid:
+        with _CLIENT_LOCK:
+            if _CLIENT['client'] is None or _CLIENT['pid'] != pid:
+                _CLIENT['client'] = CLIENT_FACTORY[0](
+                    SETTINGS['MONGO_URI'], **client_options())
+                _CLIENT['pid'] = pid
+    return _CLIENT['client']
 
 
 def db_songs():
@@ -31,19 +163,205 @@ def db_averages():
     return connection().anthology.averages
 
 
-def get_songs_list(previous_id, limit, search_term=None, search_word=None):
-    """Return songs from database. Parameters `previous_id` and `limit` are
-    used to iterate over result set.
+def db_level_totals():
+    """Return collection with running difficulty totals for each level"""
+    return connection().anthology.level_totals
 
-    Search is performed using parameter `search_term`. This performs search
-    on text index for documents. Index is always required and without it search
-    will fail.
 
-    :offset: Number of items to skip
-    :limit: Number of returned items
+def db_cache():
+    """Return collection for shared response cache"""
+    return connection().anthology.cache
+
+
+def db_versions():
+    """Return collection with data version counters"""
+    return connection().anthology.versions
+
+
+def read_preference(name):
+    """Return read preference configured for query function `name`.
+
+    Secondary reads are bounded by `MONGO_MAX_STALENESS_SECONDS`, if set.
+
+    """
+    mode = READ_MODES[READ_PREFERENCES.get(name, 'primary')]
+    if mode is Primary:
+        return Primary()
+    max_staleness = SETTINGS['MONGO_MAX_STALENESS_SECONDS']
+    return mode(max_staleness=-1 if max_staleness is None else max_staleness)
+
+
+def reader(collection, name):
+    """Return collection reading with preference of query function `name`"""
+    return collection.with_options(read_preference=read_preference(name))
+
+
+def write_concern():
+    """Return configured write concern or None for the default"""
+    w = SETTINGS['MONGO_WRITE_CONCERN']
+    timeout = SETTINGS['MONGO_WRITE_TIMEOUT_MS']
+    if w is None and timeout is None:
+        return None
+    if w is not None and str(w).isdigit():
+        w = int(w)
+    return WriteConcern(w=w, wtimeout=timeout)
+
+
+def writer(collection):
+    """Return collection writing with configured write concern"""
+    concern = write_concern()
+    if concern is None:
+        return collection
+    return collection.with_options(write_concern=concern)
+
+
+@anthology.metrics.query
+def songs_version():
+    """Return version counter of songs data.
+
+    Counter is incremented on every write, so it can be used for detecting
+    changes without querying the data.
+
+    """
+    version = db_versions().find_one({'_id': 'songs'})
+    if version is None:
+        return 0
+    return version['version']
+
+
+# Number of recent name changes stored with the names version, and maximum
+# number of song ids stored for a single change
+NAME_CHANGES = 100
+NAME_CHANGE_IDS = 1000
+
+
+@anthology.metrics.query
+def names_version():
+    """Return version counter of song titles and artists.
+
+    Counter is incremented on writes which add songs or change titles or
+    artists, see `data_changed()`.
+
+    """
+    version = db_versions().find_one({'_id': 'song_names'}, {'changes': 0})
+    if version is None:
+        return 0
+    return version['version']
+
+
+@anthology.metrics.query
+def get_name_changes(version):
+    """Return ids of songs whose titles or artists changed after given version.
+
+    Names version document keeps ids of the latest `NAME_CHANGES` changes,
+    each of which is pushed in the same update which increments the version.
+
+    :version: Names version seen by the caller, or None
+    :returns: Tuple `(version, ids)`, where ids is None if changes since the
+        given version are not known and all names should be read again
+
+    """
+    current = names_version()
+    while version is not None and current > version:
+        found = db_versions().find_one(
+            {'_id': 'song_names'},
+            {'version': 1, 'changes': {'$slice': version - current}})
+        if found is None:
+            return 0, None
+        if found['version'] != current:
+            # Changed again meanwhile, slice has wrong changes
+            current = found['version']
+            continue
+        changes = found.get('changes', [])
+        if len(changes) < current - version or None in changes:
+            break
+        return current, [song_id for ids in changes for song_id in ids]
+
+    return current, [] if current == version else None
+
+
+@anthology.metrics.query
+def data_changed(names=None):
+    """Increment songs version and invalidate cached responses.
+
+    Call this after every write to songs or averages.
+
+    :names: Ids of songs which were added or had their titles or artists
+        changed
+    :returns: None
+
+    """
+    db_versions().update_one(
+        {'_id': 'songs'}, {'$inc': {'version': 1}}, upsert=True)
+    if names:
+        # Too many ids are stored as unknown change
+        ids = list(names) if len(names) <= NAME_CHANGE_IDS else None
+        db_versions().update_one(
+            {'_id': 'song_names'},
+            {'$inc': {'version': 1},
+             '$push': {'changes': {'$each': [ids], '$slice': -NAME_CHANGES}}},
+            upsert=True)
+    anthology.cache.invalidate()
+
+
+# Fields which can be used for sorting song lists, each of these has compound
+# index with `_id`
+SORT_FIELDS = ('difficulty', 'level', 'released')
+
+
+def parse_sort(sort):
+    """Return field and direction for sort key like `level` or `-level`.
+
+    :sort: Field name, prefixed with `-` for descending order
+    :returns: Tuple `(field, direction)`
+    :raises: ValueError for fields not in SORT_FIELDS
+
+    """
+    field = sort.lstrip('-')
+    if field not in SORT_FIELDS:
+        raise ValueError("Expected sort field one of %s, but got %s" % (
+            ', '.join(SORT_FIELDS), field))
+    return field, DESCENDING if sort.startswith('-') else ASCENDING
+
+
+def keyset_query(field, direction, cursor):
+    """Return query for songs after given cursor in given sort order.
+
+    Songs are sorted by `field` and `_id` in same direction. Missing values
+    are sorted before all other values.
+
+    :field: Sort field
+    :direction: ASCENDING or DESCENDING
+    :cursor: Sort key values `[value, _id]` of the previous item
+    :returns: Query dictionary
+
+    """
+    value, previous_id = cursor
+
+    if direction == ASCENDING:
+        if value is None:
+            return {'$or': [
+                {field: None, '_id': {'$gt': previous_id}},
+                {field: {'$ne': None}}]}
+        return {'$or': [
+            {field: {'$gt': value}},
+            {field: value, '_id': {'$gt': previous_id}}]}
+
+    if value is None:
+        return {field: None, '_id': {'$lt': previous_id}}
+    return {'$or': [
+        {field: {'$lt': value}},
+        {field: value, '_id': {'$lt': previous_id}},
+        {field: None}]}
+
+
+def songs_query(previous_id=None, search_term=None, search_word=None):
+    """Return query for songs matching given search terms.
+
+    :previous_id: Return songs after this id
     :search_term: Partial word search term
     :search_word: Full word search term
-    :returns: Iterable cursor object
+    :returns: Query dictionary
 
     """
 
@@ -51,6 +369,9 @@ def get_songs_list(previous_id, limit, search_term=None, search_word=None):
 
     # Search for partial words
     if search_term:
+        narrow = anthology.trigrams.term_query(search_term)
+        if narrow:
+            query.append(narrow)
         regex = {'$regex': search_term, '$options': 'i'}
         query.append({'$or': [{'title': regex}, {'artist': regex}]})
 
@@ -67,21 +388,212 @@ def get_songs_list(previous_id, limit, search_term=None, search_word=None):
     if previous_id:
         query.append({'_id': {'$gt': ObjectId(previous_id)}})
 
-    return db_songs().find({'$and': query}).sort('_id', ASCENDING).limit(limit)
+    return {'$and': query}
 
 
-def get_average_difficulty(level):
-    """Return average difficulty for all songs on given level.
+def songs_hint(search_term=None, search_word=None):
+    """Return index hint for songs query with given search terms.
 
-    If difficulty is not given, return difficulty for all songs in database.
+    Planner may prefer walking the sort index and filtering every song over
+    sorting the candidates of trigram index, so trigram index is hinted
+    whenever partial word search is narrowed with trigrams. Full word
+    searches always use text index.
+
+    :search_term: Partial word search term
+    :search_word: Full word search term
+    :returns: Index keys or None
+
+    """
+    if search_term and not search_word and (
+            anthology.trigrams.term_query(search_term)):
+        return [(anthology.trigrams.TRIGRAM_FIELD, ASCENDING)]
+    return None
+
+
+@anthology.metrics.query
+def get_songs_list(previous_id, limit, search_term=None, search_word=None,
+                   projection=None, sort=None, cursor=None):
+    """Return songs from database. Parameters `previous_id` and `limit` are
+    used to iterate over result set.
+
+    Songs are sorted by id unless `sort` is given. Then songs are sorted by
+    given field and id, and parameter `cursor` is used instead of
+    `previous_id` to iterate over result set.
+
+    Search is performed using parameter `search_term`. This narrows songs
+    with trigram index and matches candidates with regular expression.
+
+    Full word search is performed using parameter `search_word`. This
+    performs search on text index for documents. Index is always required and
+    without it search will fail.
+
+    :offset: Number of items to skip
+    :limit: Number of returned items
+    :search_term: Partial word search term
+    :search_word: Full word search term
+    :projection: List of returned fields, all fields if not given
+    :sort: Sort field, prefixed with `-` for descending order
+    :cursor: Sort key values `[value, _id]` of the previous item
+    :returns: Iterable cursor object
+
+    """
+
+    query = songs_query(previous_id, search_term, search_word)
+    hint = songs_hint(search_term, search_word)
+
+    collection = reader(db_songs(), 'get_songs_list')
+
+    if not sort:
+        return collection.find(query, projection).sort(
+            '_id', ASCENDING).limit(limit).hint(hint)
+
+    field, direction = parse_sort(sort)
+
+    if cursor:
+        query['$and'].append(keyset_query(field, direction, cursor))
+
+    if projection:
+        projection = dict(projection, **{field: True})
+
+    return collection.find(query, projection).sort(
+        [(field, direction), ('_id', direction)]).limit(limit).hint(hint)
+
+
+def faceted_pipeline(limit, search_term=None, search_word=None,
+                     projection=None, sort=None):
+    """Return aggregation pipeline for `get_songs_faceted()`.
+
+    Without search terms level counts include all songs, so the match stage
+    intentionally scans the whole collection.
+
+    """
+
+    if sort:
+        field, direction = parse_sort(sort)
+        order = SON([(field, direction), ('_id', direction)])
+        if projection:
+            projection = dict(projection, **{field: True})
+    else:
+        order = SON([('_id', ASCENDING)])
+
+    page = [{'$sort': order}, {'$limit': limit}]
+    if projection:
+        page.append({'$project': projection})
+
+    return [
+        {'$match': songs_query(None, search_term, search_word)},
+        {'$facet': {
+            'data': page,
+            'levels': [
+                {'$group': {'_id': '$level', 'count': {'$sum': 1}}},
+                {'$sort': {'_id': ASCENDING}}],
+            'total': [{'$count': 'count'}]}}]
+
+
+@anthology.metrics.query
+def get_songs_faceted(limit, search_term=None, search_word=None,
+                      projection=None, sort=None):
+    """Return first page of songs with number of matches in each level.
+
+    Page and counts are calculated with single `$facet` aggregation sharing
+    the same match stage.
+
+    :limit: Number of returned items
+    :search_term: Partial word search term
+    :search_word: Full word search term
+    :projection: List of returned fields, all fields if not given
+    :sort: Sort field, prefixed with `-` for descending order
+    :returns: Tuple `(songs, facets)`, where facets is dictionary with
+        `total` and `levels`, list of `{"level": .., "count": ..}` items
+
+    """
+
+    pipeline = faceted_pipeline(
+        limit, search_term, search_word, projection, sort)
+
+    result = next(reader(db_songs(), 'get_songs_faceted').aggregate(
+        pipeline), None) or {}
+
+    facets = {
+        'total': sum(item['count'] for item in result.get('total', [])),
+        'levels': [
+            {'level': item['_id'], 'count': item['count']}
+            for item in result.get('levels', [])]}
+
+    return result.get('data', []), facets
 
-    :level: Song level to search
-    :collection: Collection to search from
-    :returns: Dictionary with level and average difficulty
+
+def relevance_pipeline(cursor, limit, search_word, search_term=None,
+                       projection=None):
+    """Return aggregation pipeline for `get_songs_by_relevance()`"""
+
+    pipeline = [
+        {'$match': songs_query(
+            search_term=search_term, search_word=search_word)},
+        {'$addFields': {'score': {'$meta': 'textScore'}}}]
+
+    if cursor:
+        score, previous_id = cursor
+        pipeline.append({'$match': {'$or': [
+            {'score': {'$lt': score}},
+            {'score': score, '_id': {'$gt': previous_id}}]}})
+
+    pipeline.append(
+        {'$sort': SON([('score', DESCENDING), ('_id', ASCENDING)])})
+    pipeline.append({'$limit': limit})
+
+    if projection:
+        projection = dict(projection, score=True)
+        pipeline.append({'$project': projection})
+
+    return pipeline
+
+
+@anthology.metrics.query
+def get_songs_by_relevance(cursor, limit, search_word, search_term=None,
+                           projection=None):
+    """Return songs matching full word search ordered by relevance.
+
+    Relevance score of the text index is returned in field `score`. Songs
+    with equal score are ordered by id. Parameters `cursor` and `limit` are
+    used to iterate over result set.
+
+    :cursor: Sort key values `[score, _id]` of the previous item
+    :limit: Number of returned items
+    :search_word: Full word search term
+    :search_term: Partial word search term
+    :projection: List of returned fields, all fields if not given
+    :returns: Iterable cursor object
 
     """
 
-    collection = db_songs()
+    return reader(db_songs(), 'get_songs_by_relevance').aggregate(
+        relevance_pipeline(
+            cursor, limit, search_word, search_term, projection))
+
+
+@anthology.metrics.query
+def export_songs(search_term=None, search_word=None, projection=None,
+                 batch_size=1000):
+    """Return all songs matching given search terms.
+
+    :search_term: Partial word search term
+    :search_word: Full word search term
+    :projection: List of returned fields, all fields if not given
+    :batch_size: Number of songs fetched from database at once
+    :returns: Iterable cursor object
+
+    """
+
+    query = songs_query(search_term=search_term, search_word=search_word)
+
+    return reader(db_songs(), 'export_songs').find(query, projection).sort(
+        '_id', ASCENDING).batch_size(batch_size).hint(
+            songs_hint(search_term, search_word))
+
+
+def average_pipeline(level):
+    """Return aggregation pipeline for average difficulty on given level"""
 
     pipeline = [
         {"$group": {
@@ -92,7 +604,31 @@ def get_average_difficulty(level):
     if level:
         pipeline.insert(0, {"$match": {"level": level}})
 
-    results = collection.aggregate(pipeline)
+    return pipeline
+
+
+@anthology.metrics.query
+def get_average_difficulty(level):
+    """Return average difficulty for all songs on given level.
+
+    If difficulty is not given, return difficulty for all songs in database.
+
+    Average is calculated from running level totals. If totals don't exist,
+    average is aggregated from songs collection.
+
+    :level: Song level to search
+    :collection: Collection to search from
+    :returns: Dictionary with level and average difficulty
+
+    """
+
+    average = anthology.rollups.average(
+        reader(db_level_totals(), 'get_average_difficulty'), level)
+    if average is not None:
+        return {'average_difficulty': average, 'algorithm': 'trivial'}
+
+    results = reader(db_songs(), 'get_average_difficulty').aggregate(
+        average_pipeline(level))
 
     try:
         result = results.next()
@@ -102,57 +638,290 @@ def get_average_difficulty(level):
         return {}
 
 
-def filter_songs_by_level(songs, level):
-    """Filter out all bad values"""
-    for song in songs:
-        if level is None:
-            yield song
-        if level == song["level"]:
-            yield song
+def level_statistics(total):
+    """Return statistics partial aggregate of level totals document.
+
+    Totals written before statistics were stored contain only the sum and the
+    count of difficulties.
+
+    """
+    if 'stats' in total:
+        return total['stats']
+
+    partial = anthology.stats.empty()
+    partial['count'] = total['number_of_songs']
+    partial['sum'] = str(Fraction(total['total_difficulty']))
+    partial['mean'] = total['total_difficulty'] / float(
+        total['number_of_songs'] or 1)
+    return partial
 
 
+@anthology.metrics.query
 def get_average_difficulty_fun(level):
     """Just for fun implementation for averages.
 
-    Most data was already batch processed beforehand, so we can calculate rest
-    efficiently in Python.
+    Most data was already batch processed beforehand to mergeable statistics
+    of each level, so we can combine them efficiently in Python.
 
-    If difficulty is not given, return difficulty for all songs in database.
+    If level is not given, return statistics for all songs in database.
 
     :level: Song level to search
-    :collection: Collection to search from
-    :returns: Dictionary with level and average difficulty
+    :returns: Dictionary with level, average difficulty and other statistics
 
     """
 
-    totals = db_averages().find()
-
-    total_difficulty = 0
-    number_of_songs = 0
+    if level is None:
+        query = {'level': {'$exists': True}}
+    else:
+        query = {'level': level}
 
-    for total in filter_songs_by_level(totals, level):
-        # BUGBUG: This will overflow with big dataset
-        total_difficulty += total["total_difficulty"]
-        number_of_songs += total["number_of_songs"]
+    result = anthology.stats.summary(anthology.stats.merge_all(
+        level_statistics(total) for total in reader(
+            db_averages(), 'get_average_difficulty_fun').find(query)))
 
-    if number_of_songs == 0:
+    if result is None:
         return {}
 
-    average_difficulty = total_difficulty / float(number_of_songs)
-
     return {
         'level': level,
-        'average_difficulty': average_difficulty,
+        'average_difficulty': result['average'],
+        'min_difficulty': result['min'],
+        'max_difficulty': result['max'],
+        'stddev_difficulty': result['stddev'],
+        'number_of_songs': result['count'],
+        'histogram': result['histogram'],
         'algorithm': 'fun'}
 
 
+@anthology.metrics.query
 def get_song(song_id):
     """Return song with given id"""
-    return db_songs().find_one({'_id': ObjectId(song_id)})
+    return reader(db_songs(), 'get_song').find_one(
+        {'_id': ObjectId(song_id)})
+
+
+@anthology.metrics.query
+def get_songs(song_ids, projection=None):
+    """Return many songs with single query.
+
+    :song_ids: List of song ids
+    :projection: MongoDB projection of returned fields
+    :returns: List of songs in the order of `song_ids`, None for each id
+        which is invalid or not found
+
+    """
+    valid = [ObjectId(song_id) for song_id in song_ids
+             if ObjectId.is_valid(song_id)]
+
+    songs = {}
+    if valid:
+        songs = dict(
+            (str(song['_id']), song)
+            for song in reader(db_songs(), 'get_songs').find(
+                {'_id': {'$in': valid}}, projection))
+
+    return [
+        songs.get(str(ObjectId(song_id))) if ObjectId.is_valid(song_id)
+        else None for song_id in song_ids]
+
+
+@anthology.metrics.query
+def get_song_names(ids=None):
+    """Return titles and artists of songs ordered by id.
+
+    :ids: Return only songs with these ids
+    :returns: Iterable cursor object
+
+    """
+    query = {} if ids is None else {'_id': {'$in': ids}}
+    return db_songs().find(query, {'title': True, 'artist': True}).sort(
+        '_id', ASCENDING)
 
 
+@anthology.metrics.query
 def update_song(song_id, fields):
-    """Return song with given id"""
-    db_songs().update_one(
+    """Update given fields of song with given id.
+
+    Trigrams are updated if title or artist changes and level totals if
+    difficulty or level changes.
+
+    :song_id: Song id
+    :fields: Dictionary of updated fields
+    :returns: Updated song document or None if song does not exist
+
+    """
+    collection = writer(db_songs())
+
+    names_changed = bool(set(fields) & set(anthology.trigrams.TEXT_FIELDS))
+
+    if names_changed:
+        song = collection.find_one({'_id': ObjectId(song_id)}) or {}
+        song.update(fields)
+        fields = dict(fields)
+        fields[anthology.trigrams.TRIGRAM_FIELD] = (
+            anthology.trigrams.song_trigrams(song))
+
+    # Level totals need the document before update, otherwise the updated
+    # document is returned directly
+    totals_changed = set(fields) & set(['difficulty', 'level'])
+
+    song = collection.find_one_and_update(
+        {'_id': ObjectId(song_id)},
+        {'$set': fields},
+        return_document=(
+            ReturnDocument.BEFORE if totals_changed else ReturnDocument.AFTER))
+
+    data_changed(names=[ObjectId(song_id)] if names_changed else None)
+
+    if song is None or not totals_changed:
+        return song
+
+    before = song
+    song = dict(before)
+    song.update(fields)
+
+    anthology.rollups.apply_increments(
+        db_level_totals(),
+        anthology.rollups.merge_increments(
+            anthology.rollups.level_increments([before], sign=-1),
+            anthology.rollups.level_increments([song])))
+
+    return song
+
+
+def rating_update(rating):
+    """Return update document for adding given rating to song statistics.
+
+    Song stores it's latest rating in `rating` and rating statistics in
+    `rating_stats`::
+
+        {"count": 3, "sum": 11, "histogram": {"3": 1, "4": 2}}
+
+    """
+    return {
+        '$set': {'rating': rating},
+        '$inc': {
+            'rating_stats.count': 1,
+            'rating_stats.sum': rating,
+            'rating_stats.histogram.%d' % rating: 1}}
+
+
+def rating_average(song):
+    """Return average rating from rating statistics of given song"""
+    stats = song.get('rating_stats') or {}
+    if not stats.get('count'):
+        return None
+    return stats['sum'] / float(stats['count'])
+
+
+def update_rating_averages(songs):
+    """Store average ratings of given songs for the top rated index.
+
+    Average can't be calculated atomically with `$inc`, so it is set only if
+    the rating count is still the same. If another rating was added
+    meanwhile, that update sets the average instead.
+
+    :songs: Songs with updated `rating_stats`
+    :returns: List of songs with `rating_average`
+
+    """
+    requests = []
+    for song in songs:
+        song['rating_average'] = rating_average(song)
+        requests.append(UpdateOne(
+            {'_id': song['_id'],
+             'rating_stats.count': song['rating_stats']['count']},
+            {'$set': {'rating_average': song['rating_average']}}))
+
+    if requests:
+        writer(db_songs()).bulk_write(requests, ordered=False)
+
+    return songs
+
+
+@anthology.metrics.query
+def rate_song(song_id, rating):
+    """Add rating for song with given id.
+
+    :song_id: Song id
+    :rating: Rating value
+    :returns: Updated song document or None if song does not exist
+
+    """
+    song = writer(db_songs()).find_one_and_update(
         {'_id': ObjectId(song_id)},
-        {'$set': fields})
+        rating_update(rating),
+        return_document=ReturnDocument.AFTER)
+
+    if song is None:
+        return None
+
+    update_rating_averages([song])
+    data_changed()
+
+    return song
+
+
+@anthology.metrics.query
+def update_ratings(ratings):
+    """Add ratings for many songs with single bulk write.
+
+    Updates are applied in given order, so the last rating wins if same song
+    is rated many times.
+
+    :ratings: List of `(song_id, rating)` tuples
+    :returns: List of `(song_id, status)` tuples in given order, where status
+        is `ok`, `not_found` or `invalid_id`
+
+    """
+    valid = [
+        (ObjectId(song_id), rating) for song_id, rating in ratings
+        if ObjectId.is_valid(song_id)]
+
+    if not valid:
+        return [(song_id, 'invalid_id') for song_id, _ in ratings]
+
+    collection = writer(db_songs())
+    collection.bulk_write(
+        [UpdateOne({'_id': song_id}, rating_update(rating))
+         for song_id, rating in valid],
+        ordered=True)
+
+    songs = update_rating_averages(list(collection.find(
+        {'_id': {'$in': [song_id for song_id, _ in valid]}},
+        {'_id': 1, 'rating_stats': 1})))
+    data_changed()
+
+    found = set(str(song['_id']) for song in songs)
+
+    results = []
+    for song_id, _ in ratings:
+        if not ObjectId.is_valid(song_id):
+            results.append((song_id, 'invalid_id'))
+        elif str(ObjectId(song_id)) in found:
+            results.append((song_id, 'ok'))
+        else:
+            results.append((song_id, 'not_found'))
+
+    return results
+
+
+@anthology.metrics.query
+def get_top_rated(cursor, limit):
+    """Return rated songs ordered by average rating.
+
+    :cursor: Sort key values `[rating_average, _id]` of the previous item
+    :limit: Number of returned items
+    :returns: Iterable cursor object
+
+    """
+    query = [{'rating_average': {'$gte': 0}}]
+
+    if cursor:
+        average, song_id = cursor
+        query.append({'$or': [
+            {'rating_average': {'$lt': average}},
+            {'rating_average': average, '_id': {'$lt': song_id}}]})
+
+    return reader(db_songs(), 'get_top_rated').find({'$and': query}).sort(
+        [('rating_average', DESCENDING), ('_id', DESCENDING)]).limit(limit)
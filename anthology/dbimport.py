@@ -1,14 +1,99 @@
 """Import data to songs database"""
 
+import os
 import sys
+import time
+import errno
+import logging
+import argparse
 from json import loads
 
-from pymongo import TEXT
+import anthology.database
+import anthology.indexes
+import anthology.rollups
+import anthology.trigrams
+from anthology.database import db_songs, db_level_totals
 
-from anthology.database import db_songs
 
+LOGGER = logging.getLogger(__name__)
 
-def import_json(filename, text_index=True):
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_checkpoint(checkpoint):
+    """Return line offset stored in given checkpoint file.
+
+    :checkpoint: Path to checkpoint file
+    :returns: Number of lines already imported, zero if no checkpoint exists
+    :raises: ValueError if checkpoint is empty or not a line offset, since
+        importing from the start again would duplicate songs
+
+    """
+    try:
+        with open(checkpoint) as infile:
+            content = infile.read().strip()
+    except IOError as error:
+        if error.errno == errno.ENOENT:
+            return 0
+        raise
+
+    try:
+        return int(content)
+    except ValueError:
+        raise ValueError(
+            "Invalid checkpoint %s: %r, fix or remove it" % (
+                checkpoint, content))
+
+
+def write_checkpoint(checkpoint, offset):
+    """Store line offset to given checkpoint file.
+
+    Offset is written to temporary file which then replaces the checkpoint,
+    so checkpoint is never left partially written.
+
+    :checkpoint: Path to checkpoint file
+    :offset: Number of lines imported so far
+    :returns: None
+
+    """
+    temporary = checkpoint + '.tmp'
+    with open(temporary, 'w') as outfile:
+        outfile.write('%d\n' % offset)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(temporary, checkpoint)
+
+
+def iter_batches(infile, batch_size, skip=0):
+    """Read songs lazily from file and yield them in batches.
+
+    :infile: Open file object with single JSON document on each line
+    :batch_size: Maximum number of songs in each batch
+    :skip: Number of lines to skip from the beginning of the file
+    :returns: Iterable of `(line_offset, songs)` tuples, where `line_offset`
+        is number of lines consumed after the batch
+
+    """
+    batch = []
+    offset = 0
+
+    for song_json in infile:
+        offset += 1
+        if offset <= skip:
+            continue
+        if not song_json.strip():
+            continue
+        batch.append(loads(song_json))
+        if len(batch) >= batch_size:
+            yield offset, batch
+            batch = []
+
+    if batch:
+        yield offset, batch
+
+
+def import_json(filename, text_index=True, batch_size=DEFAULT_BATCH_SIZE,
+                checkpoint=None):
     """Import data from JSON file.
 
     File must contain single dictionary on single row for each song.
@@ -19,21 +104,82 @@ def import_json(filename, text_index=True):
         {"title: "mysong 2", difficulty: 2, level: 6}
         ...
 
+    Trigrams for partial word searches are calculated for each song and
+    all indexes are created. Running difficulty totals of each level are
+    updated after each batch.
+
+    File is read lazily and songs are inserted with unordered bulk inserts of
+    `batch_size` songs. If `checkpoint` is given, number of imported lines is
+    stored there after each batch and import continues from that line on the
+    next run. Note that a crash in the middle of a batch may leave part of
+    that batch imported twice.
+
     :filename: Path to JSON file
-    :returns: None
+    :text_index: Create text index for full word searches
+    :batch_size: Number of songs in each bulk insert
+    :checkpoint: Path to checkpoint file for resuming import
+    :returns: Number of imported songs
 
     """
+    collection = db_songs()
+    level_totals = db_level_totals()
+
+    skip = read_checkpoint(checkpoint) if checkpoint else 0
+    if skip:
+        LOGGER.info("Resuming import of %s from line %d", filename, skip)
+
+    imported = 0
+    started = time.time()
+
     with open(filename) as infile:
-        for song_json in infile.readlines():
-            db_songs().insert(loads(song_json))
+        for offset, songs in iter_batches(infile, batch_size, skip):
+            if songs:
+                for song in songs:
+                    anthology.trigrams.add_trigrams(song)
+                collection.insert_many(songs, ordered=False)
+                anthology.rollups.apply_increments(
+                    level_totals, anthology.rollups.level_increments(songs))
+                anthology.database.data_changed(
+                    names=[song['_id'] for song in songs])
+                imported += len(songs)
+            if checkpoint:
+                write_checkpoint(checkpoint, offset)
+
+            elapsed = time.time() - started
+            LOGGER.info(
+                "Imported %d songs (%.0f docs/sec)",
+                imported, imported / elapsed if elapsed else 0)
+
+    anthology.indexes.ensure_indexes(text_index=text_index)
+
+    return imported
+
+
+def main(argv=None):
+    """Parse command line arguments and run the import"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('filename', help='Path to JSON file')
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help='Number of songs in each bulk insert')
+    parser.add_argument(
+        '--checkpoint', default=None,
+        help='Store import progress to this file and resume from it')
+    parser.add_argument(
+        '--no-text-index', dest='text_index', action='store_false',
+        help='Do not create text index')
+
+    args = parser.parse_args(argv)
 
-    index_fields = [
-        ('title', TEXT),
-        ('artist', TEXT)]
+    logging.basicConfig(level=logging.INFO)
 
-    if text_index:
-        db_songs().create_index(index_fields, default_language='none')
+    import_json(
+        args.filename,
+        text_index=args.text_index,
+        batch_size=args.batch_size,
+        checkpoint=args.checkpoint)
 
 
 if __name__ == "__main__":
-    import_json(sys.argv[1])
+    main(sys.argv[1:])
@@ -0,0 +1,41 @@
+"""Conditional GET support with entity tags.
+
+Entity tag of a response is derived from the request and version counter of
+songs data. When client sends matching `If-None-Match` header, resource
+method is not called at all and empty HTTP 304 response is returned.
+
+Version is read once per request and shared with the cache key of the
+response, so cached responses are always tagged with the version they were
+cached for, and writes of other processes change the tags.
+
+"""
+
+from hashlib import sha1
+from functools import wraps
+
+from flask import request, Response
+from werkzeug.http import quote_etag
+
+from anthology.cache import data_version, request_key
+
+
+def request_etag(version):
+    """Return strong entity tag for current request and data version"""
+    return sha1('%s:%s' % (request_key(), version)).hexdigest()
+
+
+def conditional(func):
+    """Decorator adding ETag header and handling `If-None-Match` requests"""
+
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        """Return HTTP 304 for matching entity tag or call resource method"""
+        etag = request_etag(data_version())
+        headers = {'ETag': quote_etag(etag)}
+
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+        return func(*args, **kwargs), 200, headers
+
+    return _wrapper
@@ -0,0 +1,124 @@
+"""Indexes required by the queries in `anthology.database`.
+
+Create all indexes with command::
+
+    python -m anthology.indexes
+
+Run this on deploy, or set `ENSURE_INDEXES` in application config to create
+indexes at application startup.
+
+"""
+
+import sys
+import argparse
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+import anthology.trigrams
+from anthology.database import db_songs, db_averages, SORT_FIELDS
+
+
+# Indexes for songs collection as `(keys, options)` tuples
+SONG_INDEXES = [
+    # get_songs_list(search_term=...)
+    ([(anthology.trigrams.TRIGRAM_FIELD, ASCENDING)], {}),
+    # get_average_difficulty(level) without level totals
+    ([('level', ASCENDING)], {}),
+    # get_top_rated()
+    ([('rating_average', DESCENDING), ('_id', DESCENDING)], {}),
+] + [
+    # get_songs_list(sort=...)
+    ([(field, ASCENDING), ('_id', ASCENDING)], {})
+    for field in SORT_FIELDS
+]
+
+# Text index for get_songs_list(search_word=...), not supported by old MongoDB
+TEXT_INDEX = (
+    [('title', TEXT), ('artist', TEXT)], {'default_language': 'none'})
+
+# Indexes for averages collection
+AVERAGE_INDEXES = [
+    # get_average_difficulty_fun(level)
+    ([('level', ASCENDING)], {}),
+]
+
+
+def ensure_indexes(text_index=True):
+    """Create all indexes, existing indexes are left as is.
+
+    :text_index: Create text index for full word searches
+    :returns: None
+
+    """
+    indexes = list(SONG_INDEXES)
+    if text_index:
+        indexes.append(TEXT_INDEX)
+
+    for keys, options in indexes:
+        db_songs().create_index(keys, **options)
+
+    for keys, options in AVERAGE_INDEXES:
+        db_averages().create_index(keys, **options)
+
+
+def winning_stages(explain, stage):
+    """Return stages of given type in the winning plan of explain output.
+
+    Works for outputs of both `find().explain()` and aggregate explain.
+
+    :explain: Explain output
+    :stage: Stage type, for example `COLLSCAN`
+    :returns: List of stages
+
+    """
+    stages = []
+
+    if isinstance(explain, dict):
+        if explain.get('stage') == stage:
+            stages.append(explain)
+        for key, value in explain.items():
+            if key != 'rejectedPlans':
+                stages.extend(winning_stages(value, stage))
+    elif isinstance(explain, list):
+        for value in explain:
+            stages.extend(winning_stages(value, stage))
+
+    return stages
+
+
+def collscans(explain):
+    """Return collection scan stages of the winning plan in explain output.
+
+    :explain: Explain output
+    :returns: List of COLLSCAN stages
+
+    """
+    return winning_stages(explain, 'COLLSCAN')
+
+
+def used_indexes(explain):
+    """Return key patterns of indexes scanned by the winning plan.
+
+    :explain: Explain output
+    :returns: List of key pattern dictionaries
+
+    """
+    return [stage['keyPattern']
+            for stage in winning_stages(explain, 'IXSCAN')]
+
+
+def main(argv=None):
+    """Parse command line arguments and create indexes"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--no-text-index', dest='text_index', action='store_false',
+        help='Do not create text index')
+
+    args = parser.parse_args(argv)
+
+    ensure_indexes(text_index=args.text_index)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
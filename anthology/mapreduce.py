@@ -0,0 +1,174 @@
+"""In-process alternative to the Luigi workflow in `anthology.aggregate`.
+
+Byte ranges of the songs data are mapped to statistics of each level in a
+multiprocessing pool, partial results are reduced in memory and totals of all
+levels are written with single bulk write. Nothing is written to `tmp/`.
+
+Run with command::
+
+    python -m anthology.mapreduce [--processes N] [filename]
+
+"""
+
+import sys
+import argparse
+import multiprocessing
+from json import loads
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import anthology.cache
+import anthology.chunks
+import anthology.database
+import anthology.stats
+from anthology.aggregate import (
+    DEFAULT_SOURCE, source_key, pending_range, totals_update, check_applied,
+    advance_source)
+
+
+def map_range(byte_range):
+    """Return statistics of each level found from a byte range.
+
+    :byte_range: Tuple `(filename, start, end)`
+    :returns: Dictionary of partial aggregates by level
+
+    """
+    filename, start, end = byte_range
+    accumulators = {}
+
+    for song_json in anthology.chunks.read_lines(filename, start, end):
+        song = loads(song_json)
+        if song["level"] not in accumulators:
+            accumulators[song["level"]] = anthology.stats.Accumulator()
+        accumulators[song["level"]].add(song["difficulty"])
+
+    return dict(
+        (level, accumulator.partial())
+        for level, accumulator in accumulators.items())
+
+
+def reduce_partials(results):
+    """Merge statistics of each level from all mapped ranges"""
+    partials = {}
+    for result in results:
+        for level, partial in result.items():
+            partials[level] = anthology.stats.merge(
+                partials.get(level, anthology.stats.empty()), partial)
+    return partials
+
+
+def map_reduce(filename, start, end, processes=None):
+    """Return statistics of each level in byte range of the songs data.
+
+    :filename: Path to songs data
+    :start: Start offset
+    :end: End offset
+    :processes: Number of worker processes, defaults to CPU count
+    :returns: Dictionary of partial aggregates by level
+
+    """
+    processes = processes or multiprocessing.cpu_count()
+    ranges = [
+        (filename, chunk_start, chunk_end)
+        for chunk_start, chunk_end in anthology.chunks.chunk_ranges(
+            start, end, processes)]
+
+    if len(ranges) <= 1:
+        return reduce_partials(map(map_range, ranges))
+
+    pool = multiprocessing.Pool(min(processes, len(ranges)))
+    try:
+        return reduce_partials(pool.imap_unordered(map_range, ranges))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def fold_totals(filename, start, end, processes=None):
+    """Add songs of the byte range to totals of all levels found from it.
+
+    Levels which already include the range are skipped, so interrupted runs
+    can be repeated.
+
+    :returns: Number of updated levels
+
+    """
+    partials = map_reduce(filename, start, end, processes)
+
+    key = source_key(filename)
+    totals = dict(
+        (total['_id'], total)
+        for total in anthology.database.db_averages().find(
+            {'_id': {'$in': list(partials)}}))
+
+    levels = []
+    requests = []
+    for level, partial in sorted(partials.items()):
+        total = totals.get(level, {})
+        watermark = total.get('watermarks', {}).get(key, 0)
+
+        if watermark >= end:
+            continue
+        if watermark > start:
+            raise RuntimeError(
+                "Totals of level %s are processed up to %s, but this range "
+                "starts from %s, recalculate averages" % (
+                    level, watermark, start))
+
+        condition, update, upsert = totals_update(
+            filename, level, total, partial, end)
+        levels.append(level)
+        requests.append(UpdateOne(condition, update, upsert=upsert))
+
+    if requests:
+        try:
+            result = anthology.database.db_averages().bulk_write(
+                requests, ordered=False)
+            applied = result.matched_count + result.upserted_count
+        except BulkWriteError as error:
+            # Other process inserted some levels after we read them
+            if any(write_error['code'] != 11000
+                   for write_error in error.details['writeErrors']):
+                raise
+            applied = 0
+        if applied < len(requests):
+            check_applied(filename, levels, end)
+        anthology.database.data_changed()
+
+    advance_source(filename, end)
+
+    return len(requests)
+
+
+def calculate_totals(filename=DEFAULT_SOURCE, processes=None):
+    """Add all songs appended since the previous run to totals"""
+
+    while True:
+        start, end = pending_range(filename)
+        if start >= end:
+            break
+        # Interrupted range is completed first and the rest on next round
+        fold_totals(filename, start, end, processes)
+
+    anthology.cache.invalidate()
+
+
+def main(argv=None):
+    """Parse command line arguments and calculate totals"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'filename', nargs='?', default=DEFAULT_SOURCE,
+        help='Songs data, one JSON document on each line')
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help='Number of worker processes, defaults to CPU count')
+
+    args = parser.parse_args(argv)
+
+    calculate_totals(args.filename, processes=args.processes)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
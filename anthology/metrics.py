@@ -0,0 +1,295 @@
+"""Request and MongoDB command metrics in Prometheus text format.
+
+Request latency is measured for each endpoint with Flask request hooks and
+MongoDB command latency with a pymongo command listener. Commands are
+attributed to the database function which issued them: functions decorated
+with `query` set the current function of the thread, and it is kept after
+the function returns, so commands of lazily iterated cursors are counted for
+the function which created the cursor.
+
+Metrics are kept in process memory as fixed bucket histograms and counters,
+so recording costs a lock and a few additions. Metrics are enabled by
+default, set `METRICS` to False in application config to disable them.
+
+"""
+
+import bisect
+import threading
+from functools import wraps
+from timeit import default_timer
+
+from flask import g, request, Response
+from flask_restful import Resource
+from pymongo import monitoring
+
+import anthology.cache
+
+# Upper bounds of histogram buckets in seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_LOCAL = threading.local()
+
+
+class Histogram(object):
+    """Latency histograms with labels"""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        """Setup class"""
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Add observation for given label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        """Forget all observations"""
+        with self.lock:
+            self.values.clear()
+
+    def lines(self):
+        """Yield metric lines in Prometheus text format"""
+        yield '# HELP %s %s' % (self.name, self.help_text)
+        yield '# TYPE %s histogram' % self.name
+
+        with self.lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.values.items()]
+
+        for labels, counts, total in sorted(values):
+            label_text = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '%s_bucket{%s} %d' % (
+                    self.name,
+                    format_labels(
+                        self.label_names + ('le',), labels + (bound,)),
+                    cumulative)
+            yield '%s_sum{%s} %r' % (self.name, label_text, total)
+            yield '%s_count{%s} %d' % (self.name, label_text, cumulative)
+
+
+class Counter(object):
+    """Counters with labels"""
+
+    def __init__(self, name, help_text, label_names):
+        """Setup class"""
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        """Increment counter of given label values"""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def clear(self):
+        """Reset all counters"""
+        with self.lock:
+            self.values.clear()
+
+    def lines(self):
+        """Yield metric lines in Prometheus text format"""
+        yield '# HELP %s %s' % (self.name, self.help_text)
+        yield '# TYPE %s counter' % self.name
+
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for labels, value in values:
+            yield '%s{%s} %d' % (
+                self.name, format_labels(self.label_names, labels), value)
+
+
+REQUEST_LATENCY = Histogram(
+    'anthology_request_seconds', 'HTTP request latency',
+    ('endpoint', 'method', 'status'))
+
+QUERY_LATENCY = Histogram(
+    'anthology_mongo_command_seconds', 'MongoDB command latency',
+    ('function', 'command'))
+
+QUERY_FAILURES = Counter(
+    'anthology_mongo_command_failures_total', 'Failed MongoDB commands',
+    ('function', 'command'))
+
+DOCUMENTS_RETURNED = Counter(
+    'anthology_mongo_documents_returned_total',
+    'Documents returned by MongoDB commands', ('function', 'command'))
+
+METRICS = [REQUEST_LATENCY, QUERY_LATENCY, QUERY_FAILURES, DOCUMENTS_RETURNED]
+
+
+def format_labels(names, values):
+    """Return Prometheus label text for given label names and values"""
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values))
+
+
+def current_function():
+    """Return name of the database function running in this thread"""
+    active = getattr(_LOCAL, 'active', None)
+    if active:
+        return active[-1]
+    return getattr(_LOCAL, 'last', None) or 'unknown'
+
+
+def query(func):
+    """Decorator attributing MongoDB commands to the database function"""
+
+    name = func.__name__
+
+    @wraps(func)
+    def _wrapper(*args, **kwargs):
+        """Set current database function of the thread"""
+        active = getattr(_LOCAL, 'active', None)
+        if active is None:
+            active = _LOCAL.active = []
+        active.append(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            active.pop()
+            # Cursors returned by outermost function are iterated later
+            if not active:
+                _LOCAL.last = name
+
+    return _wrapper
+
+
+def returned_documents(reply):
+    """Return number of documents in command reply"""
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    if 'value' in reply:
+        return 0 if reply['value'] is None else 1
+    return 0
+
+
+class CommandListener(monitoring.CommandListener):
+    """Record latency and returned documents of MongoDB commands"""
+
+    def __init__(self):
+        """Setup class"""
+        self.functions = {}
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        """Remember the function which started the command"""
+        with self.lock:
+            self.functions[event.request_id] = current_function()
+
+    def _finished(self, event):
+        """Return labels of finished command"""
+        with self.lock:
+            function = self.functions.pop(event.request_id, 'unknown')
+        return (function, event.command_name)
+
+    def succeeded(self, event):
+        """Record latency and number of returned documents"""
+        labels = self._finished(event)
+        QUERY_LATENCY.observe(labels, event.duration_micros / 1e6)
+        documents = returned_documents(event.reply)
+        if documents:
+            DOCUMENTS_RETURNED.inc(labels, documents)
+
+    def failed(self, event):
+        """Record latency and failure"""
+        labels = self._finished(event)
+        QUERY_LATENCY.observe(labels, event.duration_micros / 1e6)
+        QUERY_FAILURES.inc(labels)
+
+
+LISTENER = []
+
+
+def _before_request():
+    """Start timing the request"""
+    g.metrics_started = default_timer()
+    _LOCAL.last = None
+
+
+def _after_request(response):
+    """Record request latency"""
+    started = getattr(g, 'metrics_started', None)
+    if started is not None:
+        REQUEST_LATENCY.observe(
+            (request.endpoint or 'unknown', request.method,
+             str(response.status_code)),
+            default_timer() - started)
+    return response
+
+
+def install(app):
+    """Enable metrics for Flask application and MongoDB clients.
+
+    Command listener is registered once for each process and applies to
+    clients created after the call.
+
+    """
+    if not app.config.get('METRICS', True):
+        return False
+
+    if not LISTENER:
+        LISTENER.append(CommandListener())
+        monitoring.register(LISTENER[0])
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    return True
+
+
+def cache_lines():
+    """Yield response cache metrics in Prometheus text format"""
+    stats = anthology.cache.stats()
+    for name, value in [('hits', stats['hits']),
+                        ('misses', stats['misses'])]:
+        yield '# TYPE anthology_cache_%s_total counter' % name
+        yield 'anthology_cache_%s_total %d' % (name, value)
+    yield '# TYPE anthology_cache_hit_ratio gauge'
+    yield 'anthology_cache_hit_ratio %r' % stats['hit_ratio']
+
+
+def render():
+    """Return all metrics in Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.lines())
+    lines.extend(cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    """Reset all metrics, used in tests"""
+    for metric in METRICS:
+        metric.clear()
+
+
+class Metrics(Resource):
+    """Metrics for Prometheus"""
+
+    # pylint: disable=no-self-use
+    def get(self):
+        """GET /metrics"""
+        return Response(render(), content_type=CONTENT_TYPE)
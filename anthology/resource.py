@@ -4,17 +4,39 @@ from flask_restful import Resource, reqparse
 
 
 class ParameterResource(Resource):
-    """Resource with HTTP request parameter handling"""
+    """Resource with HTTP request parameter handling.
+
+    Parameters are declared in class attribute `arguments` as list of
+    `reqparse.Argument` objects, or added in overridden `add_arguments()`.
+    Request parser is built once for each resource class and parameters are
+    parsed once for each request.
+
+    """
+
+    arguments = None
 
     def add_arguments(self, parser):
         """Add URL parameters for the resource"""
-        raise NotImplementedError("Remember to override this")
+        if self.arguments is None:
+            raise NotImplementedError("Remember to override this")
+        for argument in self.arguments:
+            parser.add_argument(argument)
+        return parser
+
+    def request_parser(self):
+        """Return request parser of the class, build it on first call"""
+        cls = type(self)
+        parser = cls.__dict__.get('_parser')
+        if parser is None:
+            parser = reqparse.RequestParser()
+            self.add_arguments(parser)
+            cls._parser = parser
+        return parser
 
     @property
     def args(self):
         """Return request parameters as dictionary"""
-        parser = reqparse.RequestParser()
-        self.add_arguments(parser)
-        return parser.parse_args()
-
-
+        # Flask RESTful creates new resource object for each request
+        if getattr(self, '_args', None) is None:
+            self._args = self.request_parser().parse_args()
+        return self._args
@@ -0,0 +1,127 @@
+"""Running difficulty totals for each level.
+
+Rollup collection has single document for each level with sum of difficulties
+and number of songs on that level::
+
+    {"_id": 13, "sum": 42.82, "count": 3}
+
+Totals are updated atomically with `$inc` when songs are imported or
+updated, so averages can be calculated without scanning all songs.
+
+"""
+
+from numbers import Number
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+
+def level_increments(songs, sign=1):
+    """Return difficulty increments for given songs grouped by level.
+
+    Songs without numeric difficulty are ignored like in MongoDB `$avg`.
+
+    :songs: Iterable of song documents
+    :sign: Use -1 to calculate decrements for removed songs
+    :returns: Dictionary of `{level: {"sum": float, "count": int}}`
+
+    """
+    increments = {}
+    for song in songs:
+        difficulty = song.get('difficulty')
+        if not isinstance(difficulty, Number) or isinstance(difficulty, bool):
+            continue
+        total = increments.setdefault(
+            song.get('level'), {'sum': 0, 'count': 0})
+        total['sum'] += sign * difficulty
+        total['count'] += sign
+    return increments
+
+
+def merge_increments(*increments):
+    """Combine increments returned by `level_increments`"""
+    merged = {}
+    for increment in increments:
+        for level, total in increment.items():
+            merged_total = merged.setdefault(level, {'sum': 0, 'count': 0})
+            merged_total['sum'] += total['sum']
+            merged_total['count'] += total['count']
+    return merged
+
+
+def apply_increments(collection, increments):
+    """Increment level totals in given collection.
+
+    :collection: Rollup collection
+    :increments: Increments from `level_increments`
+    :returns: None
+
+    """
+    requests = [
+        UpdateOne({'_id': level}, {'$inc': total}, upsert=True)
+        for level, total in increments.items()
+        if total['count'] or total['sum']]
+
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+
+
+def average(collection, level=None):
+    """Return average difficulty from level totals.
+
+    :collection: Rollup collection
+    :level: Song level, if not given average is for all levels
+    :returns: Average difficulty or None if there are no totals
+
+    """
+    query = {'_id': level} if level else {}
+
+    total_sum = 0
+    total_count = 0
+    for total in collection.find(query):
+        total_sum += total['sum']
+        total_count += total['count']
+
+    if total_count <= 0:
+        return None
+
+    return total_sum / float(total_count)
+
+
+def rebuild(songs, collection):
+    """Recalculate all level totals from songs collection.
+
+    Totals are calculated to temporary collection, which then atomically
+    replaces the rollup collection. Songs version is incremented, so cached
+    averages are not served.
+
+    :songs: Songs collection
+    :collection: Rollup collection
+    :returns: None
+
+    """
+    temporary = '%s_rebuild' % collection.name
+
+    songs.aggregate([
+        {'$match': {'difficulty': {'$type': 'number'}}},
+        {'$group': {
+            '_id': '$level',
+            'sum': {'$sum': '$difficulty'},
+            'count': {'$sum': 1}}},
+        {'$out': temporary}])
+
+    try:
+        collection.database[temporary].rename(
+            collection.name, dropTarget=True)
+    except OperationFailure:
+        # Nothing to rename if there were no songs
+        collection.delete_many({})
+
+    # Imported here, since database depends on this module
+    import anthology.database
+    anthology.database.data_changed()
+
+
+if __name__ == "__main__":
+    from anthology.database import db_songs, db_level_totals
+    rebuild(db_songs(), db_level_totals())
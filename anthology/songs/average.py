@@ -1,8 +1,11 @@
 """Average calculation views"""
 
-from flask_restful import fields, marshal_with
+from flask_restful import fields, marshal
+from flask_restful.reqparse import Argument
 
 import anthology.database as db
+from anthology.cache import cached
+from anthology.etag import conditional
 from anthology.resource import ParameterResource
 from anthology.fields import ArbitaryFloat, Integer
 
@@ -13,28 +16,36 @@ AVERAGE_FIELDS = {
     "algorithm": fields.String()
 }
 
+FUN_AVERAGE_FIELDS = dict(AVERAGE_FIELDS, **{
+    "min_difficulty": ArbitaryFloat(2),
+    "max_difficulty": ArbitaryFloat(2),
+    "stddev_difficulty": ArbitaryFloat(2),
+    "number_of_songs": Integer(),
+    "histogram": fields.Raw()
+})
+
 
 class AverageDifficulty(ParameterResource):
     """Songs resource."""
 
-    def add_arguments(self, parser):
-        """Parse and sanitize request arguments."""
-
-        parser.add_argument(
+    arguments = [
+        Argument(
             'level', default=None,
-            type=int, help='Level of songs to get averages')
-        parser.add_argument(
+            type=int, help='Level of songs to get averages'),
+        Argument(
             'algorithm', type=str, help='Some fun averages?')
+    ]
 
-        return parser
-
-    @marshal_with(AVERAGE_FIELDS)
+    @conditional
+    @cached
     def get(self):
         """GET /songs"""
 
         if self.args.algorithm == 'fun':
-            return db.get_average_difficulty_fun(
-                level=self.args.level)
+            return marshal(
+                db.get_average_difficulty_fun(level=self.args.level),
+                FUN_AVERAGE_FIELDS)
 
-        return db.get_average_difficulty(
-            level=self.args.level)
+        return marshal(
+            db.get_average_difficulty(level=self.args.level),
+            AVERAGE_FIELDS)
@@ -1,17 +1,36 @@
 """Song ratings"""
 
-from flask_restful import fields, marshal_with
+from flask import url_for
+from flask_restful import abort, fields, marshal_with
+from flask_restful.reqparse import Argument
 
+import anthology.cursor
 import anthology.database as db
+from anthology.cache import cached
+from anthology.etag import conditional
 from anthology.resource import ParameterResource
-from anthology.fields import Integer
+from anthology.fields import ArbitaryFloat, Integer
+from anthology.songs.search import serialize_songlist
 
 
 RATING_FIELDS = {
     "id": fields.String(attribute=lambda x: x["_id"]),
-    "rating": Integer()
+    "rating": Integer(),
+    "rating_average": ArbitaryFloat(2),
+    "rating_count": Integer(attribute='rating_stats.count')
 }
 
+RATING_RESULT_FIELDS = {
+    "id": fields.String(),
+    "status": fields.String()
+}
+
+RATING_RESULTS_FIELDS = {
+    "data": fields.List(fields.Nested(RATING_RESULT_FIELDS))
+}
+
+MAX_RATINGS = 1000
+
 
 def rating_value(value):
     """Check that given value is integer and between 1 and 5."""
@@ -20,18 +39,33 @@ def rating_value(value):
     raise ValueError("Expected rating between 1 and 5, but got %s" % value)
 
 
-class Rating(ParameterResource):
-    """Ratings for songs"""
+def rating_list(value):
+    """Check that given value is list of `{"id": .., "rating": ..}` items.
 
-    def add_arguments(self, parser):
-        """Song rating gets single parameter `rating`"""
+    :returns: List of `(song_id, rating)` tuples
 
-        parser.add_argument(
-            'rating', type=rating_value)
+    """
+    if not isinstance(value, list) or len(value) > MAX_RATINGS:
+        raise ValueError(
+            "Expected list of at most %s ratings" % MAX_RATINGS)
+    try:
+        return [(str(item["id"]), rating_value(item["rating"]))
+                for item in value]
+    except (KeyError, TypeError):
+        raise ValueError("Expected ratings with keys id and rating")
 
-        return parser
+
+class Rating(ParameterResource):
+    """Ratings for songs"""
+
+    # Song rating gets single parameter `rating`
+    arguments = [
+        Argument('rating', type=rating_value)
+    ]
 
     # pylint: disable=no-self-use
+    @conditional
+    @cached
     @marshal_with(RATING_FIELDS)
     def get(self, _id):
         """Return rating for single song"""
@@ -39,6 +73,58 @@ class Rating(ParameterResource):
 
     @marshal_with(RATING_FIELDS)
     def post(self, _id):
-        """Set rating for given `song_id`"""
-        db.update_song(_id, {'rating': self.args.rating})
-        return db.get_song(_id)
+        """Add rating for given `song_id`"""
+        return db.rate_song(_id, self.args.rating)
+
+
+class Ratings(ParameterResource):
+    """Set many ratings at once"""
+
+    # Ratings are given as JSON list `ratings`
+    arguments = [
+        Argument(
+            'ratings', type=rating_list, location='json', required=True,
+            help='List of {"id": <song id>, "rating": <1-5>} items')
+    ]
+
+    @marshal_with(RATING_RESULTS_FIELDS)
+    def post(self):
+        """Set ratings and return status for each rating"""
+        results = db.update_ratings(self.args.ratings)
+        return {'data': [
+            {'id': song_id, 'status': status}
+            for song_id, status in results]}
+
+
+class TopRated(ParameterResource):
+    """Songs ordered by average rating"""
+
+    arguments = [
+        Argument(
+            'limit', default=10, type=int, help='Number of items to return'),
+        Argument(
+            'cursor', default=None, type=anthology.cursor.decode,
+            help='Return items after this cursor')
+    ]
+
+    @conditional
+    @cached
+    def get(self):
+        """GET /songs/top-rated"""
+
+        if self.args.cursor is not None and len(self.args.cursor) != 2:
+            abort(400, message={'cursor': 'Invalid cursor'})
+
+        limit = min(self.args.limit, 100)
+
+        songs = list(db.get_top_rated(cursor=self.args.cursor, limit=limit))
+
+        if songs:
+            cursor = anthology.cursor.encode(
+                [songs[-1]["rating_average"], songs[-1]["_id"]])
+            pagination = url_for(
+                getattr(self, 'endpoint'), cursor=cursor, limit=limit)
+        else:
+            pagination = None
+
+        return serialize_songlist(songs, pagination)
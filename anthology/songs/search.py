@@ -1,11 +1,21 @@
 """Views for songs and searches"""
 
-from flask import url_for
-from flask_restful import fields, marshal_with
+from collections import OrderedDict
 
+from itertools import islice
+from json import dumps
+
+from flask import url_for, Response, stream_with_context
+from flask_restful import fields, inputs, abort
+from flask_restful.reqparse import Argument
+
+import anthology.cursor
 import anthology.database as db
+from anthology.cache import cached
+from anthology.etag import conditional
 from anthology.resource import ParameterResource
-from anthology.fields import Integer
+from anthology.fields import ArbitaryFloat, Integer
+from anthology.serializer import Serializer
 
 
 SONG_FIELDS = {
@@ -16,6 +26,8 @@ SONG_FIELDS = {
     "level": fields.String(),
     "released": fields.String(),
     "rating": Integer(),
+    "rating_average": ArbitaryFloat(2),
+    "rating_count": Integer(attribute='rating_stats.count'),
     "rating_url": fields.Url('song_rating')
 }
 
@@ -24,38 +36,198 @@ SONGLIST_FIELDS = {
     "next": fields.String()  # fields.Url() line urlparse() is broken
 }
 
+# Maximum number of songs fetched with one request to `/songs/batch`
+MAX_IDS = 100
+
+# Database fields required by each field in SONG_FIELDS
+SONG_PROJECTIONS = {
+    "id": ["_id"],
+    "artist": ["artist"],
+    "title": ["title"],
+    "difficulty": ["difficulty"],
+    "level": ["level"],
+    "released": ["released"],
+    "rating": ["rating"],
+    "rating_average": ["rating_average"],
+    "rating_count": ["rating_stats.count"],
+    "rating_url": ["_id"]
+}
+
+
+def field_list(value):
+    """Check that given value is comma separated list of song fields.
+
+    :returns: Tuple of field names
+
+    """
+    names = tuple(name.strip() for name in value.split(',') if name.strip())
+    for name in names:
+        if name not in SONG_FIELDS:
+            raise ValueError("Unknown field %s, expected one of %s" % (
+                name, ', '.join(sorted(SONG_FIELDS))))
+    return names
+
+
+def id_list(value):
+    """Check that given value is comma separated list of at most MAX_IDS ids.
+
+    :returns: List of ids
+
+    """
+    ids = [song_id.strip() for song_id in value.split(',') if song_id.strip()]
+    if not ids or len(ids) > MAX_IDS:
+        raise ValueError("Expected 1 to %s comma separated ids" % MAX_IDS)
+    return ids
+
+
+def sort_key(value):
+    """Check that given value is valid sort key like `level` or `-level`"""
+    db.parse_sort(value)
+    return value
+
+
+def song_projection(names):
+    """Return MongoDB projection for given song fields"""
+    if not names:
+        return None
+    return dict(
+        (field, True) for name in names for field in SONG_PROJECTIONS[name])
+
+
+# Compiled serializers for each requested combination of fields
+SERIALIZERS = {}
+
+
+def song_serializer(names=None):
+    """Return compiled serializer for given song fields"""
+    names = tuple(sorted(set(names or ())))
+    if names not in SERIALIZERS:
+        if names:
+            song_fields = dict((name, SONG_FIELDS[name]) for name in names)
+        else:
+            song_fields = SONG_FIELDS
+        SERIALIZERS[names] = Serializer(song_fields)
+    return SERIALIZERS[names]
+
+
+def serialize_songlist(songs, pagination, names=None):
+    """Return song list response, same as marshalling with SONGLIST_FIELDS
+
+    :songs: List of song documents
+    :pagination: URL for the next page
+    :names: Names of returned song fields
+    :returns: Response dictionary
+
+    """
+    response = OrderedDict()
+    for key, field in SONGLIST_FIELDS.items():
+        if key == "data":
+            response[key] = song_serializer(names).many(songs)
+        else:
+            response[key] = field.output(key, {"next": pagination})
+    return response
+
+
+# Search and projection parameters shared by song listings
+SEARCH_ARGUMENTS = [
+    Argument(
+        'message', default=None,
+        type=str, help='Search term (partial word)'),
+    Argument(
+        'word', default=None,
+        type=str, help='Search term (full word)'),
+    Argument(
+        'fields', default=None,
+        type=field_list, help='Comma separated list of returned fields')
+]
+
 
 class SongList(ParameterResource):
     """Songs resource."""
 
-    def add_arguments(self, parser):
-        """Parameters for the resource"""
+    # Facets of the first page, set by `query()` when requested
+    facets = None
+
+    arguments = [
+        Argument(
+            'limit', default=10, type=int, help='Number of items to return'),
+        Argument(
+            'previous_id', type=str, help="Return items after this item"),
+        Argument(
+            'cursor', default=None, type=anthology.cursor.decode,
+            help='Return items after this cursor'),
+        Argument(
+            'order', default=None, choices=('relevance',),
+            help='Order full word search results by relevance'),
+        Argument(
+            'sort', default=None, type=sort_key,
+            help='Sort by difficulty, level or released, prefix - for '
+                 'descending order'),
+        Argument(
+            'facets', default=False, type=inputs.boolean,
+            help='Return number of matches in total and in each level with '
+                 'the first page')
+    ] + SEARCH_ARGUMENTS
 
-        parser.add_argument(
-            'limit', default=10, type=int, help='Number of items to return')
-        parser.add_argument(
-            'previous_id', type=str, help="Return items after this item")
-        parser.add_argument(
-            'message', default=None,
-            type=str, help='Search term (partial word)')
-        parser.add_argument(
-            'word', default=None,
-            type=str, help='Search term (full word)')
+    def query(self):
+        """Return songs and sort keys for the cursor of the next page"""
 
-        return parser
+        if self.args.facets:
+            if self.args.previous_id or self.args.cursor is not None:
+                abort(400, message={
+                    'facets': 'Facets are returned only with the first page'})
+            if self.args.order:
+                abort(400, message={
+                    'facets': 'Facets can not be used with relevance order'})
 
-    @marshal_with(SONGLIST_FIELDS)
+        if self.args.cursor is not None and len(self.args.cursor) != 2:
+            abort(400, message={'cursor': 'Invalid cursor'})
+
+        if self.args.order == 'relevance':
+            if not self.args.word:
+                abort(400, message={
+                    'order': 'Relevance order requires search term word'})
+            if self.args.sort:
+                abort(400, message={
+                    'sort': 'Sort can not be used with relevance order'})
+            results = db.get_songs_by_relevance(
+                cursor=self.args.cursor,
+                limit=self.args.limit,
+                search_word=self.args.word,
+                search_term=self.args.message,
+                projection=song_projection(self.args.fields))
+            return results, ['score', '_id']
+
+        if self.args.facets:
+            results, self.facets = db.get_songs_faceted(
+                limit=self.args.limit,
+                search_term=self.args.message,
+                search_word=self.args.word,
+                projection=song_projection(self.args.fields),
+                sort=self.args.sort)
+        else:
+            results = db.get_songs_list(
+                previous_id=self.args.previous_id,
+                limit=self.args.limit,
+                search_term=self.args.message,
+                search_word=self.args.word,
+                projection=song_projection(self.args.fields),
+                sort=self.args.sort,
+                cursor=self.args.cursor)
+
+        if self.args.sort:
+            return results, [db.parse_sort(self.args.sort)[0], '_id']
+        return results, None
+
+    @conditional
+    @cached
     def get(self):
         """GET /songs"""
 
         if self.args.limit > 100:
             self.args.limit = 100
 
-        results = db.get_songs_list(
-            previous_id=self.args.previous_id,
-            limit=self.args.limit,
-            search_term=self.args.message,
-            search_word=self.args.word)
+        results, cursor_keys = self.query()
 
         songlist = list(results)
 
@@ -63,10 +235,84 @@ class SongList(ParameterResource):
             endpoint=getattr(self, 'endpoint'),
             items=songlist,
             limit=self.args.limit,
+            cursor_keys=cursor_keys,
             message=self.args.message,
-            word=self.args.word)
+            word=self.args.word,
+            order=self.args.order,
+            sort=self.args.sort,
+            fields=','.join(self.args.fields or []) or None)
+
+        response = serialize_songlist(songlist, pagination, self.args.fields)
+        if self.args.facets:
+            response['facets'] = self.facets
+        return response
+
+
+class SongExport(ParameterResource):
+    """Stream all songs as newline delimited JSON"""
+
+    batch_size = 1000
+
+    arguments = SEARCH_ARGUMENTS
+
+    def get(self):
+        """GET /songs/export"""
+
+        songs = db.export_songs(
+            search_term=self.args.message,
+            search_word=self.args.word,
+            projection=song_projection(self.args.fields),
+            batch_size=self.batch_size)
+        serializer = song_serializer(self.args.fields)
 
-        return {'data': songlist, 'next': pagination}
+        def _generate():
+            """Yield songs one batch at a time"""
+            while True:
+                batch = list(islice(songs, self.batch_size))
+                if not batch:
+                    break
+                yield ''.join(
+                    dumps(song) + '\n' for song in serializer.many(batch))
+
+        return Response(
+            stream_with_context(_generate()),
+            mimetype='application/x-ndjson')
+
+
+class SongBatch(ParameterResource):
+    """Many songs by id in one request"""
+
+    arguments = [
+        Argument(
+            'ids', required=True, type=id_list,
+            help='Comma separated list of song ids'),
+        Argument(
+            'fields', default=None,
+            type=field_list, help='Comma separated list of returned fields')
+    ]
+
+    @conditional
+    @cached
+    def get(self):
+        """GET /songs/batch
+
+        Songs are returned in the requested order. Items of missing ids are
+        null and the ids are listed in `missing`.
+
+        """
+
+        songs = db.get_songs(
+            self.args.ids, projection=song_projection(self.args.fields))
+
+        serialized = iter(song_serializer(self.args.fields).many(
+            [song for song in songs if song is not None]))
+
+        return {
+            'data': [
+                None if song is None else next(serialized) for song in songs],
+            'missing': [
+                song_id for song_id, song in zip(self.args.ids, songs)
+                if song is None]}
 
 
 class SongSearch(SongList):
@@ -75,12 +321,22 @@ class SongSearch(SongList):
     pass
 
 
-def pagination_uri(endpoint, items, limit, **kwargs):
-    """Return paginated URL for given endpoint."""
+def pagination_uri(endpoint, items, limit, cursor_keys=None, **kwargs):
+    """Return paginated URL for given endpoint.
+
+    By default next page starts after id of the last item. If `cursor_keys`
+    is given, next page starts after cursor with values of these keys.
+
+    """
 
     if items == []:
         return None
 
+    if cursor_keys:
+        cursor = anthology.cursor.encode(
+            [items[-1].get(key) for key in cursor_keys])
+        return url_for(endpoint, cursor=cursor, limit=limit, **kwargs)
+
     last_id = items[-1]["_id"]
 
     return url_for(endpoint, previous_id=last_id, limit=limit, **kwargs)
@@ -0,0 +1,41 @@
+"""Autocomplete views"""
+
+import six
+from flask_restful import fields, marshal_with
+from flask_restful.reqparse import Argument
+
+import anthology.suggest
+from anthology.resource import ParameterResource
+
+SUGGESTION_FIELDS = {
+    "text": fields.String(),
+    "field": fields.String(),
+    "id": fields.String()
+}
+
+SUGGESTIONS_FIELDS = {
+    "data": fields.List(fields.Nested(SUGGESTION_FIELDS))
+}
+
+MAX_SUGGESTIONS = 50
+
+
+class Suggest(ParameterResource):
+    """Titles and artists with a word starting with given prefix"""
+
+    arguments = [
+        Argument(
+            'prefix', required=True, type=six.text_type,
+            help='Beginning of a word in title or artist'),
+        Argument(
+            'limit', default=10, type=int, help='Number of items to return')
+    ]
+
+    @marshal_with(SUGGESTIONS_FIELDS)
+    def get(self):
+        """GET /songs/suggest"""
+        suggestions = anthology.suggest.suggest(
+            self.args.prefix, limit=min(self.args.limit, MAX_SUGGESTIONS))
+        return {'data': [
+            {'field': field, 'text': text, 'id': song_id}
+            for field, text, song_id in suggestions]}
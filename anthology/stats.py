@@ -0,0 +1,167 @@
+"""Mergeable partial aggregates of song difficulties.
+
+Partial aggregate is a dictionary which can be stored to MongoDB::
+
+    {"count": 3, "sum": "1157/25", "min": 2.0, "max": 15.0,
+     "mean": 15.4266, "m2": 98.12, "histogram": {"2": 1, "14": 1, "15": 1}}
+
+Sum is exact fraction stored as string, so it never overflows or loses
+precision. Mean and `m2` (sum of squared differences from the mean) are
+updated with Welford's algorithm and merged with Chan's parallel algorithm,
+so variance stays numerically stable.
+
+"""
+
+import math
+from fractions import Fraction
+
+
+def empty():
+    """Return partial aggregate of no values"""
+    return {
+        'count': 0,
+        'sum': '0',
+        'min': None,
+        'max': None,
+        'mean': 0.0,
+        'm2': 0.0,
+        'histogram': {}}
+
+
+def bucket(value):
+    """Return histogram bucket for given difficulty"""
+    return str(int(math.floor(value)))
+
+
+class Accumulator(object):
+    """Collect partial aggregate of values one at a time.
+
+    Running sum is kept as `Fraction` and converted to string only when the
+    partial aggregate is returned, so adding a value doesn't parse the sum.
+
+    """
+
+    def __init__(self):
+        """Setup class"""
+        self.count = 0
+        self.total = Fraction(0)
+        self.minimum = None
+        self.maximum = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.histogram = {}
+
+    def add(self, value):
+        """Add single value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / float(self.count)
+        self.m2 += delta * (value - self.mean)
+        self.total += Fraction(value)
+
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+        key = bucket(value)
+        self.histogram[key] = self.histogram.get(key, 0) + 1
+
+    def partial(self):
+        """Return partial aggregate of added values"""
+        return {
+            'count': self.count,
+            'sum': str(self.total),
+            'min': self.minimum,
+            'max': self.maximum,
+            'mean': self.mean,
+            'm2': self.m2,
+            'histogram': dict(self.histogram)}
+
+
+def from_values(values):
+    """Return partial aggregate of given values"""
+    accumulator = Accumulator()
+    for value in values:
+        accumulator.add(value)
+    return accumulator.partial()
+
+
+def _extreme(function, first, second):
+    """Return `function` of two values, unknown values are ignored"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return function(first, second)
+
+
+def merge(first, second):
+    """Return partial aggregate combining two partial aggregates.
+
+    :first: Partial aggregate
+    :second: Partial aggregate
+    :returns: New partial aggregate
+
+    """
+    if not first['count']:
+        return dict(second, histogram=dict(second['histogram']))
+    if not second['count']:
+        return dict(first, histogram=dict(first['histogram']))
+
+    count = first['count'] + second['count']
+    delta = second['mean'] - first['mean']
+
+    histogram = dict(first['histogram'])
+    for key, value in second['histogram'].items():
+        histogram[key] = histogram.get(key, 0) + value
+
+    return {
+        'count': count,
+        'sum': str(Fraction(first['sum']) + Fraction(second['sum'])),
+        'min': _extreme(min, first['min'], second['min']),
+        'max': _extreme(max, first['max'], second['max']),
+        'mean': first['mean'] + delta * second['count'] / float(count),
+        'm2': first['m2'] + second['m2'] + delta * delta * (
+            first['count'] * second['count'] / float(count)),
+        'histogram': histogram}
+
+
+def merge_all(partials):
+    """Return partial aggregate combining all given partial aggregates"""
+    result = empty()
+    for partial in partials:
+        result = merge(result, partial)
+    return result
+
+
+def total(partial):
+    """Return sum of the values in partial aggregate as float"""
+    return float(Fraction(partial['sum']))
+
+
+def summary(partial):
+    """Return statistics of partial aggregate.
+
+    Average is calculated from the exact sum and variance is population
+    variance.
+
+    :partial: Partial aggregate
+    :returns: Dictionary with `count`, `average`, `min`, `max`, `variance`,
+        `stddev` and `histogram`, or None if there are no values
+
+    """
+    count = partial['count']
+    if not count:
+        return None
+
+    variance = partial['m2'] / count
+
+    return {
+        'count': count,
+        'average': float(Fraction(partial['sum']) / count),
+        'min': partial['min'],
+        'max': partial['max'],
+        'variance': variance,
+        'stddev': math.sqrt(max(variance, 0.0)),
+        'histogram': partial['histogram']}
@@ -0,0 +1,222 @@
+"""In-memory autocomplete index of song titles and artists.
+
+Index is a sorted list of `(word, entry id)` pairs of normalized words of
+each title and artist. Candidates are found with binary search on the word of
+the prefix which matches fewest pairs, and the whole prefix is checked from
+the text of each candidate, so lookups take `O(w log n + m)` time without
+database queries, where `w` is the number of words in the prefix and `m` the
+number of pairs matching the selected word. Matches are returned in
+alphabetical order of the selected word.
+
+Index is loaded from songs collection when the application starts. Writes
+which add songs or change titles or artists increment the names version and
+record ids of the changed songs. When the version changes, names of these
+songs are added to the index, at most once in `refresh_interval` seconds.
+Previous titles of renamed songs are kept until the index is loaded again,
+which happens if more changes were made than are recorded.
+
+"""
+
+import re
+import bisect
+import threading
+import unicodedata
+from timeit import default_timer
+
+import six
+
+import anthology.database
+from anthology.trigrams import TEXT_FIELDS
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Greater than any entry id, for finding the end of pairs of a word
+MAX_ID = float('inf')
+
+
+def normalize(text):
+    """Return text in lower case without accents and repeated whitespace"""
+    if not isinstance(text, six.text_type):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text)
+    text = u''.join(char for char in text if not unicodedata.combining(char))
+    return u' '.join(text.lower().split())
+
+
+def word_starts(text):
+    """Return positions where words of normalized text start"""
+    return [match.start() for match in WORD.finditer(text)]
+
+
+def word_range(keys, word):
+    """Return index range of pairs with given word in sorted pairs"""
+    return (bisect.bisect_left(keys, (word,)),
+            bisect.bisect_left(keys, (word, MAX_ID)))
+
+
+def prefix_range(keys, prefix):
+    """Return index range of pairs with words starting with given prefix"""
+    # Words with the prefix end before words with greater last character
+    following = prefix[:-1] + six.unichr(ord(prefix[-1]) + 1)
+    return (bisect.bisect_left(keys, (prefix,)),
+            bisect.bisect_left(keys, (following,)))
+
+
+class SuggestIndex(object):
+    """Sorted word index of titles and artists"""
+
+    def __init__(self, refresh_interval=5.0, clock=default_timer):
+        """Setup class"""
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        # Tuple of word pairs, entries, normalized texts of entries and
+        # entry ids of indexed texts. Loading replaces the tuple, so readers
+        # always see consistent snapshot without locking
+        self.data = ([], [], [], {})
+        self.version = None
+        self.checked = None
+        self.lock = threading.RLock()
+
+    def add(self, songs):
+        """Add titles and artists of given songs to the index.
+
+        Each distinct title and artist is indexed once, titles with the id of
+        the first song having it. Entries are appended before the sorted
+        pairs are replaced, so concurrent searches never see words without
+        entries.
+
+        :songs: Iterable of song documents
+        :returns: Number of added entries
+
+        """
+        with self.lock:
+            keys, entries, texts, indexed = self.data
+            first = len(entries)
+            added = []
+            for song in songs:
+                for field in TEXT_FIELDS:
+                    text = song.get(field)
+                    normalized = normalize(text) if text else None
+                    if not text or (field, normalized) in indexed:
+                        continue
+                    entry_id = len(entries)
+                    indexed[(field, normalized)] = entry_id
+                    song_id = str(song['_id']) if field == 'title' else None
+                    entries.append((field, text, song_id))
+                    texts.append(normalized)
+                    added.extend(
+                        (word, entry_id)
+                        for word in set(WORD.findall(normalized)))
+
+            if added:
+                # Timsort keeps the sorted pairs as one run, so adding k
+                # pairs takes O(n + k log k) time. Previous list is left for
+                # concurrent readers
+                keys = keys + added
+                keys.sort()
+                self.data = (keys, entries, texts, indexed)
+
+            return len(entries) - first
+
+    def load(self):
+        """Replace the index with titles and artists of all songs.
+
+        :returns: Number of indexed entries
+
+        """
+        index = SuggestIndex()
+        with self.lock:
+            added = index.add(anthology.database.get_song_names())
+            self.data = index.data
+        return added
+
+    def search(self, prefix, limit=10):
+        """Return entries with a word starting with given prefix.
+
+        :prefix: Search prefix, normalized like indexed text
+        :limit: Maximum number of returned entries
+        :returns: List of `(field, text, song_id)` tuples, song id is None for
+            artists
+
+        """
+        prefix = normalize(prefix)
+        matches = list(WORD.finditer(prefix))
+        if not matches or matches[0].start() > 0:
+            return []
+
+        keys, entries, texts, _ = self.data
+        # Words followed by more of the prefix must match completely
+        ranges = [word_range(keys, match.group()) for match in matches
+                  if match.end() < len(prefix)]
+        if matches[-1].end() == len(prefix):
+            ranges.append(prefix_range(keys, matches[-1].group()))
+        start, end = min(ranges, key=lambda bounds: bounds[1] - bounds[0])
+
+        results = []
+        seen = set()
+
+        for index in six.moves.range(start, end):
+            if len(results) >= limit:
+                break
+            entry_id = keys[index][1]
+            if entry_id in seen:
+                continue
+            text = texts[entry_id]
+            if any(text.startswith(prefix, word_start)
+                   for word_start in word_starts(text)):
+                seen.add(entry_id)
+                results.append(entries[entry_id])
+
+        return results
+
+    def refresh(self, force=False):
+        """Add songs whose names changed since the previous refresh.
+
+        Index is loaded again if the changes are not known.
+
+        :force: Check for changes even if refresh interval has not passed
+        :returns: None
+
+        """
+        now = self.clock()
+        if not force and self.checked is not None and (
+                now - self.checked < self.refresh_interval):
+            return
+
+        with self.lock:
+            if not force and self.checked is not None and (
+                    now - self.checked < self.refresh_interval):
+                return
+            self.checked = now
+
+            # Version is read first, so changes made while reading names are
+            # added on the next refresh
+            version, ids = anthology.database.get_name_changes(self.version)
+            if version == self.version:
+                return
+            if ids is None:
+                self.load()
+            elif ids:
+                self.add(anthology.database.get_song_names(ids))
+            self.version = version
+
+
+INDEX = [SuggestIndex()]
+
+
+def configure(config):
+    """Create and load new index with settings from application config.
+
+    `SUGGEST_REFRESH_SECONDS` sets the refresh interval.
+
+    """
+    INDEX[0] = SuggestIndex(
+        refresh_interval=config.get('SUGGEST_REFRESH_SECONDS', 5.0))
+    INDEX[0].refresh(force=True)
+
+
+def suggest(prefix, limit=10):
+    """Return autocomplete entries for given prefix, see `SuggestIndex`"""
+    index = INDEX[0]
+    index.refresh()
+    return index.search(prefix, limit)
@@ -0,0 +1,98 @@
+"""Trigram index for partial word searches.
+
+Each song stores trigrams of it's lowercased title and artist in
+`TRIGRAM_FIELD`. Field has a multikey index, so search terms can be narrowed
+to candidate songs containing all trigrams of the term before the final
+regular expression match.
+
+"""
+
+import re
+
+from pymongo import ASCENDING
+
+
+TRIGRAM_FIELD = 'trigrams'
+
+TEXT_FIELDS = ('title', 'artist')
+
+# Search terms with these characters are regular expressions and can't be
+# narrowed with trigrams
+REGEX_CHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+def trigrams(text):
+    """Return set of trigrams for given text.
+
+    :text: String to split into trigrams
+    :returns: Set of three character strings
+
+    """
+    text = text.lower()
+    return set(text[index:index + 3] for index in range(len(text) - 2))
+
+
+def song_trigrams(song):
+    """Return sorted list of trigrams for title and artist of given song"""
+    grams = set()
+    for field in TEXT_FIELDS:
+        value = song.get(field)
+        if value:
+            grams.update(trigrams(value))
+    return sorted(grams)
+
+
+def add_trigrams(song):
+    """Add trigram field to given song document.
+
+    :song: Song document
+    :returns: Same document with trigrams
+
+    """
+    song[TRIGRAM_FIELD] = song_trigrams(song)
+    return song
+
+
+def term_query(search_term):
+    """Return query narrowing songs to candidates for given search term.
+
+    :search_term: Partial word search term
+    :returns: Query dictionary or None if term can't be narrowed
+
+    """
+    if REGEX_CHARACTERS.search(search_term):
+        return None
+
+    grams = trigrams(search_term)
+    if not grams:
+        return None
+
+    return {TRIGRAM_FIELD: {'$all': sorted(grams)}}
+
+
+def create_index(collection):
+    """Create multikey index for trigrams"""
+    collection.create_index([(TRIGRAM_FIELD, ASCENDING)])
+
+
+def rebuild(collection):
+    """Recalculate trigrams for all songs in collection.
+
+    Songs version is incremented, so cached search results are not served.
+
+    """
+    songs = collection.find({}, dict((field, 1) for field in TEXT_FIELDS))
+    for song in songs:
+        collection.update_one(
+            {'_id': song['_id']},
+            {'$set': {TRIGRAM_FIELD: song_trigrams(song)}})
+    create_index(collection)
+
+    # Imported here, since database depends on this module
+    import anthology.database
+    anthology.database.data_changed()
+
+
+if __name__ == "__main__":
+    from anthology.database import db_songs
+    rebuild(db_songs())
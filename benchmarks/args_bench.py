@@ -0,0 +1,50 @@
+"""Compare per request argument parsing overhead.
+
+Old implementation built new request parser and parsed the request every
+time `args` was accessed. `SongList.get` accesses it seven times.
+
+Usage::
+
+    python -m benchmarks.args_bench
+
+"""
+
+import timeit
+
+from flask_restful import reqparse
+
+from anthology.api import get_app
+from anthology.songs.search import SongList
+
+URI = '/songs?limit=20&message=night&fields=id,title'
+
+
+def uncached_request(resource):
+    """Parse arguments seven times with new parser each time"""
+    for _ in range(7):
+        parser = reqparse.RequestParser()
+        resource.add_arguments(parser)
+        parser.parse_args()
+
+
+def cached_request():
+    """Parse arguments with shared parser once for new resource object"""
+    resource = SongList()
+    for _ in range(7):
+        resource.args  # pylint: disable=pointless-statement
+
+
+def main(number=2000):
+    """Print time per request for both implementations"""
+
+    with get_app().test_request_context(URI):
+        for name, func in [
+                ('uncached', lambda: uncached_request(SongList())),
+                ('cached', cached_request)]:
+            seconds = min(timeit.repeat(func, number=number, repeat=3))
+            print('%-10s %8.1f us / request' % (
+                name, 1000000 * seconds / number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Seeded generator for synthetic song catalogs.
+
+Same seed and size always give the same catalog, so benchmark results of
+different commits are comparable.
+
+Usage::
+
+    python -m benchmarks.catalog <number of songs> <filename> [seed]
+
+"""
+
+import sys
+import random
+from itertools import count as counter, islice
+from json import dumps
+
+WORDS = (
+    'night fire heart rain love dream road moon wolf storm river ghost '
+    'summer shadow light stone city blue golden wild electric silent '
+    'broken lonely burning frozen dancing falling rising endless kennel '
+    'metamorphosis lycanthropic awaki waki yousicians finger fast').split()
+
+LEVELS = 20
+
+
+def songs(count, seed=0):
+    """Yield `count` synthetic song documents, or endlessly if None.
+
+    Titles and artists are built from a small vocabulary so that searches
+    match realistic fractions of the catalog.
+
+    """
+    generator = random.Random(seed)
+    for index in islice(counter(), count):
+        yield {
+            'artist': 'The %s %ss' % (
+                generator.choice(WORDS).capitalize(),
+                generator.choice(WORDS).capitalize()),
+            'title': '%s %s %d' % (
+                generator.choice(WORDS).capitalize(),
+                generator.choice(WORDS), index),
+            'difficulty': round(generator.uniform(1, 20), 2),
+            'level': generator.randint(1, LEVELS),
+            'released': '%04d-%02d-%02d' % (
+                generator.randint(1990, 2016), generator.randint(1, 12),
+                generator.randint(1, 28))}
+
+
+def write_catalog(filename, count, seed=0):
+    """Write catalog as songs data with one JSON document on each line"""
+    with open(filename, 'w') as outfile:
+        for song in songs(count, seed):
+            outfile.write(dumps(song) + '\n')
+    return count
+
+
+if __name__ == '__main__':
+    write_catalog(sys.argv[2], int(sys.argv[1]), *[
+        int(arg) for arg in sys.argv[3:4]])
@@ -0,0 +1,265 @@
+"""Load benchmark of imports, totals and API endpoints with synthetic catalog.
+
+Catalog of given size is generated with `benchmarks.catalog`, imported to
+MongoDB and each endpoint is requested with concurrent clients. Latency
+percentiles and throughput of each scenario are printed and compared with
+the stored baseline of the same catalog size and seed.
+
+Usage::
+
+    python -m benchmarks.load_bench [--songs 100000] [--requests 1000]
+        [--threads 4] [--cache none] [--save-baseline] [--tolerance 1.5]
+
+Run against a scratch MongoDB (see `ANTHOLOGY_MONGO_URI`), the benchmark
+refuses to run if the songs collection is not empty and drops all anthology
+collections when done.
+
+Exit status is 1 if 95th percentile latency or throughput of any scenario is
+worse than the baseline by more than `--tolerance` times, or if there is no
+baseline for the catalog. Baselines are
+machine specific, store them with `--save-baseline` on the machine which runs
+the comparisons.
+
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from math import ceil
+from timeit import default_timer
+
+import anthology.database as db
+from anthology.api import get_app
+from anthology.aggregate import calculate_totals
+from anthology.dbimport import import_json
+from benchmarks.catalog import WORDS, LEVELS, write_catalog
+
+BASELINE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def sample_ids(context, count=1):
+    """Return comma separated ids of random songs"""
+    return ','.join(context['random'].sample(context['ids'], count))
+
+
+# Request scenarios as `(name, method, uri function, data function)` tuples
+SCENARIOS = [
+    ('songs', 'GET', lambda c: '/songs?limit=20', None),
+    ('songs_sort', 'GET', lambda c: '/songs?limit=20&sort=-difficulty', None),
+    ('search', 'GET', lambda c: '/songs/search?limit=20&message=%s' % (
+        c['random'].choice(WORDS)[:4]), None),
+    ('search_word', 'GET', lambda c: '/songs/search?limit=20&word=%s' % (
+        c['random'].choice(WORDS)), None),
+    ('avg', 'GET', lambda c: '/songs/avg?level=%s' % (
+        c['random'].randint(1, LEVELS)), None),
+    ('avg_fun', 'GET', lambda c: '/songs/avg?algorithm=fun&level=%s' % (
+        c['random'].randint(1, LEVELS)), None),
+    ('rating', 'GET', lambda c: '/songs/rating/%s' % sample_ids(c), None),
+    ('rate', 'POST', lambda c: '/songs/rating/%s' % sample_ids(c),
+     lambda c: {'rating': c['random'].randint(1, 5)}),
+    ('batch', 'GET', lambda c: '/songs/batch?ids=%s' % sample_ids(c, 20),
+     None),
+    ('top_rated', 'GET', lambda c: '/songs/top-rated?limit=20', None),
+]
+
+
+def percentile(values, percent):
+    """Return nearest rank percentile of sorted values.
+
+    :values: Sorted list of values
+    :percent: Percentile greater than 0 and at most 100
+
+    """
+    count = len(values)
+    return values[min(count - 1, int(ceil(percent * count / 100.0)) - 1)]
+
+
+def run_scenario(app, scenario, requests, threads, ids, seed=0):
+    """Run requests of a scenario with concurrent clients.
+
+    :returns: Dictionary with latency percentiles in milliseconds and
+        throughput in requests per second
+
+    """
+    _, method, uri, data = scenario
+    latencies = []
+    errors = []
+
+    def _client(index):
+        """Send requests and collect latencies of one client"""
+        client = app.test_client()
+        context = {'random': random.Random(seed + index), 'ids': ids}
+        for _ in range(requests // threads):
+            args = (uri(context),)
+            kwargs = {'data': data(context)} if data else {}
+            started = default_timer()
+            response = client.open(*args, method=method, **kwargs)
+            latencies.append(default_timer() - started)
+            if response.status_code != 200:
+                errors.append('%s %s' % (args[0], response.status_code))
+
+    workers = [
+        threading.Thread(target=_client, args=(index,))
+        for index in range(threads)]
+    started = default_timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = default_timer() - started
+
+    if errors:
+        raise RuntimeError("Requests failed: %s" % ', '.join(errors[:5]))
+
+    latencies.sort()
+    return {
+        'p50': 1000 * percentile(latencies, 50),
+        'p95': 1000 * percentile(latencies, 95),
+        'p99': 1000 * percentile(latencies, 99),
+        'max': 1000 * latencies[-1],
+        'throughput': len(latencies) / seconds}
+
+
+def timed(func, *args, **kwargs):
+    """Return seconds used for calling `func`"""
+    started = default_timer()
+    func(*args, **kwargs)
+    return default_timer() - started
+
+
+def run_batch(filename, songs):
+    """Time import and totals, return results like `run_scenario()`"""
+    results = {}
+    for name, func, kwargs in [
+            ('import_json', import_json, {}),
+            ('totals_luigi', calculate_totals, {'engine': 'luigi'}),
+            ('totals_pool', calculate_totals, {'engine': 'pool'})]:
+        if name == 'totals_pool':
+            db.db_averages().delete_many({})
+        seconds = timed(func, filename, **kwargs)
+        results[name] = {'seconds': seconds, 'throughput': songs / seconds}
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Return descriptions of results worse than baseline"""
+    found = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['throughput'] * tolerance < expected['throughput']:
+            found.append('%s throughput %.1f/s, baseline %.1f/s' % (
+                name, result['throughput'], expected['throughput']))
+        if 'p95' in expected and result['p95'] > expected['p95'] * tolerance:
+            found.append('%s p95 %.2f ms, baseline %.2f ms' % (
+                name, result['p95'], expected['p95']))
+    return found
+
+
+def print_results(results):
+    """Print results as a table"""
+    print('%-14s %9s %9s %9s %9s %11s' % (
+        'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'per second'))
+    for name, result in sorted(results.items()):
+        if 'p50' in result:
+            print('%-14s %9.2f %9.2f %9.2f %9.2f %11.1f' % (
+                name, result['p50'], result['p95'], result['p99'],
+                result['max'], result['throughput']))
+        else:
+            print('%-14s %9s %9s %9s %9s %11.1f' % (
+                name, '', '', '', '', result['throughput']))
+
+
+def drop_collections():
+    """Drop all collections written by the benchmark"""
+    for collection in (db.db_songs, db.db_averages, db.db_level_totals,
+                       db.db_cache, db.db_versions):
+        collection().drop()
+
+
+def main(argv=None):
+    """Parse command line arguments and run the benchmark"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--songs', type=int, default=100000, help='Size of the catalog')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='Seed of the catalog')
+    parser.add_argument(
+        '--requests', type=int, default=1000,
+        help='Number of requests in each scenario')
+    parser.add_argument(
+        '--threads', type=int, default=4, help='Number of concurrent clients')
+    parser.add_argument(
+        '--cache', default='none', choices=('none', 'memory', 'mongo'),
+        help='Response cache backend')
+    parser.add_argument(
+        '--tolerance', type=float, default=1.5,
+        help='Allowed slowdown compared to baseline')
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Store results as the new baseline')
+
+    args = parser.parse_args(argv)
+
+    if args.requests < args.threads:
+        parser.error("--requests must be at least --threads")
+
+    db.configure()
+    if db.db_songs().count():
+        sys.exit("Songs collection is not empty, use scratch database")
+
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    filename = os.path.join(directory, 'songs.json')
+
+    try:
+        # Luigi workflow writes intermediate files to tmp/
+        os.chdir(directory)
+        write_catalog(filename, args.songs, args.seed)
+
+        results = run_batch(filename, args.songs)
+
+        app = get_app({'CACHE_BACKEND': args.cache})
+        ids = [str(song['_id']) for song in db.db_songs().find({}, {'_id': 1})]
+        for scenario in SCENARIOS:
+            results[scenario[0]] = run_scenario(
+                app, scenario, args.requests, args.threads, ids, args.seed)
+    finally:
+        os.chdir(cwd)
+        drop_collections()
+        shutil.rmtree(directory)
+
+    print_results(results)
+
+    baseline_file = os.path.join(
+        BASELINE_DIRECTORY, 'load_%s_%s.json' % (args.songs, args.seed))
+
+    if args.save_baseline:
+        if not os.path.isdir(BASELINE_DIRECTORY):
+            os.makedirs(BASELINE_DIRECTORY)
+        with open(baseline_file, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+        print('Baseline stored to %s' % baseline_file)
+        return
+
+    if not os.path.exists(baseline_file):
+        sys.exit('No baseline %s, store one with --save-baseline' %
+                 baseline_file)
+
+    with open(baseline_file) as infile:
+        found = regressions(results, json.load(infile), args.tolerance)
+
+    if found:
+        sys.exit('REGRESSIONS:\n  %s' % '\n  '.join(found))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,56 @@
+"""Compare `flask_restful.marshal` with compiled song list serializer.
+
+Usage::
+
+    python -m benchmarks.serializer_bench [number of songs]
+
+"""
+
+import sys
+import timeit
+from json import dumps
+
+from bson import ObjectId
+from flask_restful import marshal
+
+from anthology.api import get_app
+from anthology.songs.search import SONGLIST_FIELDS, serialize_songlist
+
+
+def songs(count):
+    """Return list of synthetic song documents"""
+    return [{
+        '_id': ObjectId(),
+        'artist': 'Artist %d' % index,
+        'title': 'Title %d' % index,
+        'difficulty': index / 7.0,
+        'level': index % 20,
+        'released': '2016-10-26',
+        'rating': index % 5 + 1,
+        'rating_average': 3.5,
+        'rating_stats': {'count': 2, 'sum': 7},
+        'trigrams': ['art', 'rti', 'tis', 'ist', 'tit', 'itl', 'tle']
+    } for index in range(count)]
+
+
+def main(count=100, repeat=200):
+    """Print time for serializing `count` songs with both serializers"""
+
+    items = songs(count)
+
+    with get_app().test_request_context('/songs'):
+        expected = dumps(marshal(
+            {'data': items, 'next': None}, SONGLIST_FIELDS))
+        assert dumps(serialize_songlist(items, None)) == expected
+
+        for name, func in [
+                ('marshal', lambda: marshal(
+                    {'data': items, 'next': None}, SONGLIST_FIELDS)),
+                ('compiled', lambda: serialize_songlist(items, None))]:
+            seconds = min(timeit.repeat(func, number=repeat, repeat=3))
+            print('%-10s %8.3f ms / %d songs' % (
+                name, 1000 * seconds / repeat, count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
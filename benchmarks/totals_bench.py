@@ -0,0 +1,80 @@
+"""Compare Luigi workflow and multiprocessing pool in `calculate_totals()`.
+
+Synthetic songs data of given size is generated to a temporary file and
+totals are calculated with both engines.
+
+Usage::
+
+    python -m benchmarks.totals_bench [size in megabytes] [processes]
+
+Totals are written to the averages collection of the configured database
+(see `ANTHOLOGY_MONGO_URI`), so run this against a scratch MongoDB. The
+benchmark refuses to run if the averages collection is not empty and removes
+the totals it wrote when done.
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from json import dumps
+
+import anthology.database as db
+from anthology.aggregate import calculate_totals
+from benchmarks.catalog import songs
+
+
+def write_songs(filename, size, seed=0):
+    """Write songs data of at least `size` bytes to `filename`"""
+    written = 0
+    count = 0
+    with open(filename, 'w') as outfile:
+        for song in songs(None, seed):
+            line = dumps(song) + '\n'
+            outfile.write(line)
+            written += len(line)
+            count += 1
+            if written >= size:
+                break
+    return count
+
+
+def main(megabytes=100, processes=4):
+    """Print time for calculating totals with both engines"""
+
+    if db.db_averages().count():
+        sys.exit("Averages collection is not empty, use scratch database")
+
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        # Luigi workflow writes intermediate files to tmp/
+        os.chdir(directory)
+        filename = os.path.join(directory, 'songs.json')
+        count = write_songs(filename, megabytes * 1024 * 1024)
+
+        results = {}
+        for engine in ('luigi', 'pool'):
+            started = time.time()
+            calculate_totals(
+                filename=filename, chunks=processes, engine=engine)
+            seconds = time.time() - started
+
+            results[engine] = db.get_average_difficulty_fun(None)
+            db.db_averages().delete_many({})
+
+            print('%-6s %8.2f s  %10.0f songs / s' % (
+                engine, seconds, count / seconds))
+
+        for key in ('number_of_songs', 'average_difficulty', 'histogram'):
+            assert results['luigi'][key] == results['pool'][key]
+        assert results['pool']['number_of_songs'] == count
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
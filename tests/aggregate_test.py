@@ -0,0 +1,50 @@
+"""Test the `anthology/aggregate` module"""
+
+import anthology.database as db
+from anthology.aggregate import calculate_totals
+
+
+def test_incremental_totals(tmpdir):
+    """Only songs appended after the previous run are added to totals"""
+
+    source = tmpdir.join('songs.json')
+    source.write(
+        '{"title": "a", "difficulty": 2, "level": 1}\n'
+        '{"title": "b", "difficulty": 4, "level": 1}\n')
+
+    calculate_totals(filename=str(source))
+    assert db.get_average_difficulty_fun(1)["average_difficulty"] == 3
+
+    # Partial line is left for the next run
+    source.write(
+        '{"title": "c", "difficulty": 9, "level": 1}\n'
+        '{"title": "d", "difficulty": 5, "level": 21}\n'
+        '{"title": "e", "diffi', mode='a')
+
+    calculate_totals(filename=str(source))
+    assert db.get_average_difficulty_fun(1)["average_difficulty"] == 5
+    assert db.get_average_difficulty_fun(21)["average_difficulty"] == 5
+
+    calculate_totals(filename=str(source))
+    assert db.get_average_difficulty_fun(None)["average_difficulty"] == 5
+    assert db.get_average_difficulty_fun(None)["number_of_songs"] == 4
+    assert db.get_average_difficulty_fun(1)["min_difficulty"] == 2
+    assert db.get_average_difficulty_fun(1)["max_difficulty"] == 9
+
+
+def test_legacy_totals(tmpdir):
+    """Totals stored without watermarks are replaced, not added to"""
+
+    source = tmpdir.join('songs.json')
+    source.write(
+        '{"title": "a", "difficulty": 2, "level": 1}\n'
+        '{"title": "b", "difficulty": 4, "level": 1}\n')
+
+    db.db_averages().replace_one(
+        {'_id': 1},
+        {'_id': 1, 'level': 1, 'total_difficulty': 6, 'number_of_songs': 2},
+        upsert=True)
+
+    calculate_totals(filename=str(source))
+    assert db.get_average_difficulty_fun(1)["average_difficulty"] == 3
+    assert db.get_average_difficulty_fun(1)["number_of_songs"] == 2
@@ -1,10 +1,13 @@
 """Test the `anthology/api` module"""
 
-from json import loads
+from json import loads, dumps
 
 import pytest
+from six.moves.urllib.parse import urlparse, parse_qs
 
+import anthology.cursor
 from anthology.aggregate import calculate_totals
+from anthology.database import db_songs, db_versions
 
 
 @pytest.mark.parametrize('uri', [
@@ -170,3 +173,278 @@ def test_rating_invalid(response_fx, client_fx):
 
     rating = response_fx(song["rating_url"])
     assert rating["rating"] == 5
+
+
+@pytest.mark.parametrize('uri', [
+    '/songs', '/songs/avg', '/songs/search?message=ing'])
+def test_conditional_get(client_fx, uri):
+    """Matching If-None-Match returns empty HTTP 304 response"""
+
+    response = client_fx.get(uri)
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+
+    response = client_fx.get(uri, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client_fx.get(uri, headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+
+def test_conditional_get_changed(response_fx, client_fx):
+    """Entity tag changes when songs are updated"""
+
+    uri = response_fx('/songs')["data"][0]["rating_url"]
+    etag = client_fx.get(uri).headers['ETag']
+
+    client_fx.post(uri, data={'rating': 3})
+
+    response = client_fx.get(uri, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_bulk_ratings(response_fx, client_fx):
+    """POST /songs/ratings
+
+    Test setting many ratings with single request.
+
+    """
+    songs = response_fx('/songs?limit=2')["data"]
+    ratings = [
+        {'id': songs[0]["id"], 'rating': 2},
+        {'id': songs[1]["id"], 'rating': 3},
+        {'id': '0' * 24, 'rating': 4},
+        {'id': 'bad', 'rating': 4}]
+
+    response = client_fx.post(
+        '/songs/ratings', data=dumps({'ratings': ratings}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert [item["status"] for item in loads(response.data)["data"]] == [
+        'ok', 'ok', 'not_found', 'invalid_id']
+
+    assert response_fx(songs[0]["rating_url"])["rating"] == 2
+    assert response_fx(songs[1]["rating_url"])["rating"] == 3
+
+    response = client_fx.post(
+        '/songs/ratings', data=dumps({'ratings': [{'id': songs[0]["id"]}]}),
+        content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_rating_statistics(response_fx, client_fx):
+    """Ratings are collected to average rating of each song"""
+
+    song = response_fx('/songs')["data"][0]
+
+    for value in [1, 2, 4]:
+        client_fx.post(song["rating_url"], data={'rating': value})
+
+    rating = response_fx(song["rating_url"])
+    assert rating["rating"] == 4
+    assert rating["rating_count"] == 3
+    assert rating["rating_average"] == 2.33
+
+
+def test_top_rated(response_fx, client_fx):
+    """GET /songs/top-rated
+
+    Test iteration over songs ordered by average rating.
+
+    """
+    songs = response_fx('/songs?limit=3')["data"]
+    for song, value in zip(songs, [3, 5, 4]):
+        client_fx.post(song["rating_url"], data={'rating': value})
+
+    response = response_fx('/songs/top-rated?limit=2')
+    assert [item["id"] for item in response["data"]] == [
+        songs[1]["id"], songs[2]["id"]]
+
+    response = response_fx(response["next"])
+    assert [item["id"] for item in response["data"]] == [songs[0]["id"]]
+
+    response = response_fx(response["next"])
+    assert response["data"] == []
+    assert response["next"] is None
+
+    response = client_fx.get('/songs/top-rated?cursor=%s' % (
+        anthology.cursor.encode([5])))
+    assert response.status_code == 400
+
+
+def test_songs_fields(response_fx, client_fx):
+    """GET /songs?fields=
+
+    Only requested fields are returned and kept in pagination.
+
+    """
+    response = response_fx('/songs?limit=2&fields=id,title')
+    assert [sorted(song) for song in response["data"]] == [
+        ['id', 'title'], ['id', 'title']]
+    assert parse_qs(urlparse(response["next"]).query)["fields"] == [
+        'id,title']
+
+    response = response_fx(response["next"])
+    assert sorted(response["data"][0]) == ['id', 'title']
+
+    response = client_fx.get('/songs?fields=id,secret')
+    assert response.status_code == 400
+
+
+def test_export(client_fx):
+    """GET /songs/export
+
+    All matching songs are streamed as newline delimited JSON.
+
+    """
+    response = client_fx.get('/songs/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    songs = [loads(line) for line in response.data.splitlines()]
+    assert len(songs) == 11
+    assert 'rating_url' in songs[0]
+
+    response = client_fx.get('/songs/export?message=ing&fields=id,title')
+    songs = [loads(line) for line in response.data.splitlines()]
+    assert len(songs) == 4
+    assert sorted(songs[0]) == ['id', 'title']
+
+
+@pytest.mark.text_index
+def test_search_relevance(response_fx, client_fx):
+    """GET /songs/search?word=&order=relevance
+
+    Test iteration over full word search results ordered by relevance.
+
+    """
+    response = response_fx('/songs/search?word=the&order=relevance&limit=4')
+    songs = response["data"]
+    assert len(songs) == 4
+    assert 'cursor' in response["next"]
+
+    while response["next"]:
+        response = response_fx(response["next"])
+        songs = songs + response["data"]
+
+    assert len(songs) == 10
+    assert len(set(song["id"] for song in songs)) == 10
+
+    response = client_fx.get('/songs/search?order=relevance')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('sort', ['difficulty', '-difficulty', 'level'])
+def test_songs_sort(response_fx, sort):
+    """GET /songs?sort=
+
+    Test iteration over songs sorted by given field.
+
+    """
+    field = sort.lstrip('-')
+    response = response_fx('/songs?limit=3&sort=%s&fields=id,%s' % (
+        sort, field))
+    songs = response["data"]
+    assert 'cursor' in response["next"]
+
+    while response["next"]:
+        response = response_fx(response["next"])
+        songs = songs + response["data"]
+
+    assert len(set(song["id"] for song in songs)) == 11
+
+    values = [float(song[field]) for song in songs]
+    assert values == sorted(values, reverse=sort.startswith('-'))
+
+
+def test_songs_sort_invalid(client_fx):
+    """Only indexed fields can be used for sorting"""
+    response = client_fx.get('/songs?sort=title')
+    assert response.status_code == 400
+
+
+def test_songs_batch(response_fx, client_fx):
+    """GET /songs/batch?ids=
+
+    Songs are returned in requested order and missing ids are marked.
+
+    """
+    songs = response_fx('/songs?limit=3')["data"]
+    ids = [songs[2]["id"], '0' * 24, songs[0]["id"], 'bad']
+
+    response = response_fx('/songs/batch?ids=%s' % ','.join(ids))
+    assert response["data"][0] == songs[2]
+    assert response["data"][1] is None
+    assert response["data"][2] == songs[0]
+    assert response["data"][3] is None
+    assert response["missing"] == ['0' * 24, 'bad']
+
+    response = response_fx('/songs/batch?ids=%s&fields=id,title' % ids[0])
+    assert sorted(response["data"][0]) == ['id', 'title']
+
+    response = client_fx.get('/songs/batch?ids=%s' % ','.join(['a'] * 101))
+    assert response.status_code == 400
+
+
+def test_search_facets(response_fx, client_fx):
+    """GET /songs/search?facets=true
+
+    First page is returned with number of matches in total and each level.
+
+    """
+    response = response_fx('/songs/search?message=ing&limit=2&facets=true')
+    assert len(response["data"]) == 2
+    assert response["facets"]["total"] == 4
+    assert sum(item["count"] for item in response["facets"]["levels"]) == 4
+    assert 'facets' not in response["next"]
+
+    levels = [item["level"] for item in response["facets"]["levels"]]
+    assert levels == sorted(levels)
+
+    response = response_fx('/songs?facets=true&sort=-difficulty')
+    assert response["facets"]["total"] == 11
+    values = [song["difficulty"] for song in response["data"]]
+    assert values == sorted(values, reverse=True)
+
+    response = response_fx(response["next"])
+    assert 'facets' not in response
+
+    response = client_fx.get('/songs?facets=true&previous_id=%s' % ('0' * 24))
+    assert response.status_code == 400
+
+
+def test_suggest(response_fx, client_fx):
+    """GET /songs/suggest?prefix="""
+
+    response = response_fx('/songs/suggest?prefix=lyc')
+    assert response["data"] == [{
+        'field': 'title', 'text': 'Lycanthropic Metamorphosis',
+        'id': response["data"][0]["id"]}]
+
+    response = response_fx('/songs/suggest?prefix=the%20you')
+    assert response["data"][0]["text"] == 'The Yousicians'
+    assert response["data"][0]["id"] is None
+
+    response = response_fx('/songs/suggest?prefix=waki&limit=1')
+    assert [item["text"] for item in response["data"]] == ['Awaki-Waki']
+
+    response = client_fx.get('/songs/suggest')
+    assert response.status_code == 400
+
+
+def test_conditional_get_other_process(client_fx):
+    """Writes made by other processes change the entity tag and response"""
+
+    song = db_songs().find_one({'rating': 5})
+    uri = '/songs/rating/%s' % song['_id']
+    etag = client_fx.get(uri).headers['ETag']
+
+    db_songs().update_one({'_id': song['_id']}, {'$set': {'rating': 1}})
+    db_versions().update_one({'_id': 'songs'}, {'$inc': {'version': 1}})
+
+    response = client_fx.get(uri, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert loads(response.data)["rating"] == 1
@@ -0,0 +1,60 @@
+"""Test the `anthology/cache` module"""
+
+from json import loads
+
+import anthology.cache
+import anthology.database
+from anthology.cache import LRUCache, MISSING
+
+
+def test_lru_cache():
+    """Least recently used and expired items are dropped"""
+
+    now = [0]
+    cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert len(cache) == 2
+
+    now[0] = 11
+    assert cache.get('a') is MISSING
+
+
+def test_cached_responses(client_fx):
+    """Responses are cached until songs are updated"""
+
+    stats = anthology.cache.stats()
+
+    uri = loads(client_fx.get('/songs').data)["data"][0]["rating_url"]
+    assert loads(client_fx.get(uri).data)["rating"] == 5
+    assert loads(client_fx.get(uri + '?x=1&y=2').data)["rating"] == 5
+    assert loads(client_fx.get(uri + '?y=2&x=1').data)["rating"] == 5
+
+    assert anthology.cache.stats()["misses"] == stats["misses"] + 3
+    assert anthology.cache.stats()["hits"] == stats["hits"] + 1
+
+    client_fx.post(uri, data={'rating': 2})
+    assert loads(client_fx.get(uri).data)["rating"] == 2
+
+
+def test_cached_other_process(client_fx):
+    """Writes of other processes are seen through the data version"""
+
+    song = anthology.database.db_songs().find_one({'rating': 5})
+    uri = '/songs/rating/%s' % song['_id']
+    assert loads(client_fx.get(uri).data)["rating"] == 5
+
+    # Other process writes without clearing the cache of this process
+    anthology.database.db_songs().update_one(
+        {'_id': song['_id']}, {'$set': {'rating': 1}})
+    assert loads(client_fx.get(uri).data)["rating"] == 5
+
+    anthology.database.db_versions().update_one(
+        {'_id': 'songs'}, {'$inc': {'version': 1}}, upsert=True)
+    assert loads(client_fx.get(uri).data)["rating"] == 1
@@ -0,0 +1,24 @@
+"""Test the `anthology/chunks` module"""
+
+from anthology.chunks import data_end, chunk_ranges, read_lines
+
+
+def test_chunks(tmpdir):
+    """Each line is read from exactly one chunk"""
+
+    lines = [b'x' * index + b'\n' for index in range(20)]
+    source = tmpdir.join('lines.txt')
+    source.write(b''.join(lines) + b'partial', mode='wb')
+    filename = str(source)
+
+    end = data_end(filename)
+    assert end == len(b''.join(lines))
+
+    for chunks in [1, 3, 7, 100]:
+        ranges = chunk_ranges(0, end, chunks)
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == end
+        result = [
+            line for start, stop in ranges
+            for line in read_lines(filename, start, stop)]
+        assert result == lines
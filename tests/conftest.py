@@ -7,7 +7,7 @@ from json import loads
 import pytest
 
 
-from anthology.database import db_songs, db_averages
+from anthology.database import db_songs, db_averages, db_level_totals
 from anthology.dbimport import import_json
 from anthology.api import get_app
 
@@ -22,6 +22,10 @@ def pytest_addoption(parser):
     parser.addoption(
         "--skip-text-index", action="store_true",
         help="Do not test MongoDB text indexes", default=False)
+    parser.addoption(
+        "--replica-set-uri", default=None,
+        help="Test read preferences against this replica set, for example "
+             "mongodb://localhost:27017/?replicaSet=rs0")
 
 
 def pytest_runtest_setup(item):
@@ -31,6 +35,10 @@ def pytest_runtest_setup(item):
         if item.config.getoption("--skip-text-index"):
             pytest.skip("Skipping tests requiring MongoDB text indexes")
 
+    if 'replica_set' in item.keywords:
+        if not item.config.getoption("--replica-set-uri"):
+            pytest.skip("Skipping tests requiring MongoDB replica set")
+
 
 @pytest.fixture(scope="function")
 def client_fx():
@@ -59,6 +67,7 @@ def testdata_fx(request):
 
     db_songs().remove()
     db_averages().remove()
+    db_level_totals().remove()
     import_json(
         'tests/data/songs.json',
         not request.config.getoption('--skip-text-index'))
@@ -0,0 +1,172 @@
+"""Test the `anthology/database` module"""
+
+import pytest
+
+from pymongo.read_preferences import Primary, Secondary
+
+import anthology.database
+import anthology.rollups
+from anthology.dbimport import import_json
+
+
+class FakeClient(object):
+    """Record MongoClient arguments"""
+
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        """Mark client closed"""
+        self.closed = True
+
+
+@pytest.fixture(scope='function')
+def fake_client_fx():
+    """Install fake client factory for the duration of the test"""
+    factory = anthology.database.CLIENT_FACTORY[0]
+    anthology.database.set_client_factory(FakeClient)
+    yield
+    anthology.database.set_client_factory(factory)
+
+
+@pytest.mark.usefixtures('fake_client_fx')
+def test_connection_shared(monkeypatch):
+    """Client is created once per process and again after fork"""
+
+    client = anthology.database.connection()
+    assert anthology.database.connection() is client
+
+    monkeypatch.setattr('os.getpid', lambda: -1)
+    assert anthology.database.connection() is not client
+    assert not client.closed
+
+
+@pytest.mark.usefixtures('fake_client_fx')
+def test_configure(monkeypatch):
+    """Settings are read from environment and application config"""
+
+    settings = dict(anthology.database.SETTINGS)
+    monkeypatch.setenv('ANTHOLOGY_MONGO_MAX_POOL_SIZE', '7')
+
+    try:
+        anthology.database.configure({
+            'MONGO_URI': 'mongodb://example.com/',
+            'MONGO_WAIT_QUEUE_TIMEOUT_MS': 500})
+        client = anthology.database.connection()
+    finally:
+        anthology.database.SETTINGS.update(settings)
+
+    assert client.uri == 'mongodb://example.com/'
+    assert client.options['maxPoolSize'] == 7
+    assert client.options['waitQueueTimeoutMS'] == 500
+
+
+@pytest.mark.usefixtures('fake_client_fx')
+def test_read_preferences():
+    """Read preference of each query function can be configured"""
+
+    db = anthology.database
+    settings = dict(db.SETTINGS)
+
+    try:
+        db.configure({
+            'MONGO_READ_PREFERENCES': {'get_songs_list': 'secondary'},
+            'MONGO_MAX_STALENESS_SECONDS': 120,
+            'MONGO_WRITE_CONCERN': 'majority',
+            'MONGO_WRITE_TIMEOUT_MS': 1000})
+
+        preference = db.read_preference('get_songs_list')
+        assert isinstance(preference, Secondary)
+        assert preference.max_staleness == 120
+        assert isinstance(db.read_preference('get_song'), Primary)
+        assert isinstance(db.read_preference('songs_version'), Primary)
+        assert db.write_concern().document == {
+            'w': 'majority', 'wtimeout': 1000}
+
+        with pytest.raises(ValueError):
+            db.configure({'MONGO_READ_PREFERENCES': {'get_song': 'any'}})
+    finally:
+        db.SETTINGS.update(settings)
+        db.configure()
+
+    assert db.READ_PREFERENCES == db.DEFAULT_READ_PREFERENCES
+    # Cached and versioned reads stay on primary by default
+    assert isinstance(db.read_preference('get_songs_list'), Primary)
+    assert isinstance(db.read_preference('get_average_difficulty'), Primary)
+
+
+@pytest.mark.replica_set
+def test_replica_set(request):
+    """Queries and majority writes work against a replica set.
+
+    With single host replica set this does not test routing to secondaries,
+    only that read preferences and write concerns are accepted.
+
+    """
+
+    db = anthology.database
+    settings = dict(db.SETTINGS)
+
+    try:
+        db.configure({
+            'MONGO_URI': request.config.getoption('--replica-set-uri'),
+            'MONGO_READ_PREFERENCES': {'get_songs_list': 'secondaryPreferred'},
+            'MONGO_MAX_STALENESS_SECONDS': 90,
+            'MONGO_WRITE_CONCERN': 'majority'})
+        db.db_songs().delete_many({})
+        import_json('tests/data/songs.json', text_index=False)
+
+        songs = list(db.get_songs_list(None, 20))
+        assert len(songs) == 11
+
+        db.rate_song(songs[0]['_id'], 4)
+        assert db.get_song(songs[0]['_id'])['rating'] == 4
+    finally:
+        db.db_songs().drop()
+        db.db_level_totals().drop()
+        db.db_versions().drop()
+        db.SETTINGS.update(settings)
+        db.configure()
+
+
+def test_level_totals():
+    """Level totals follow song updates and survive rebuild"""
+
+    db = anthology.database
+    before = db.get_average_difficulty(13)["average_difficulty"]
+
+    song = db.db_songs().find_one({'level': 13})
+    db.update_song(song["_id"], {'level': 9})
+    assert db.get_average_difficulty(13)["average_difficulty"] != before
+
+    db.update_song(song["_id"], {'level': 13})
+    assert round(db.get_average_difficulty(13)["average_difficulty"], 6) == \
+        round(before, 6)
+
+    db.db_level_totals().remove()
+    version = db.songs_version()
+    anthology.rollups.rebuild(db.db_songs(), db.db_level_totals())
+    assert db.songs_version() > version
+    assert round(db.get_average_difficulty(None)["average_difficulty"], 2) \
+        == 10.32
+
+
+def test_name_changes(monkeypatch):
+    """Ids of renamed songs are recorded with the names version"""
+
+    db = anthology.database
+    version, ids = db.get_name_changes(None)
+    assert ids is None
+    assert db.get_name_changes(version) == (version, [])
+
+    song = db.db_songs().find_one()
+    db.update_song(song['_id'], {'title': 'Renamed'})
+    db.update_song(song['_id'], {'difficulty': 1})
+    assert db.get_name_changes(version) == (version + 1, [song['_id']])
+
+    monkeypatch.setattr(db, 'NAME_CHANGES', 1)
+    db.update_song(song['_id'], {'title': 'Renamed again'})
+    assert db.get_name_changes(version) == (version + 2, None)
+    assert db.get_name_changes(version + 1) == (version + 2, [song['_id']])
@@ -0,0 +1,52 @@
+"""Test the `anthology/dbimport` module"""
+
+import pytest
+
+from anthology.database import db_songs
+from anthology.dbimport import (
+    import_json, iter_batches, read_checkpoint, write_checkpoint)
+
+
+def test_iter_batches():
+    """Songs are read in batches and skipped lines are not returned"""
+
+    lines = ['{"level": %d}\n' % level for level in range(5)]
+
+    batches = list(iter_batches(iter(lines), 2))
+    assert [offset for offset, _ in batches] == [2, 4, 5]
+    assert [len(songs) for _, songs in batches] == [2, 2, 1]
+
+    batches = list(iter_batches(iter(lines), 2, skip=3))
+    assert batches == [(5, [{"level": 3}, {"level": 4}])]
+
+
+def test_import_checkpoint(tmpdir):
+    """Import continues from the checkpoint of the previous run"""
+
+    checkpoint = str(tmpdir.join('import.checkpoint'))
+    count = db_songs().count()
+
+    assert import_json(
+        'tests/data/songs.json', False, batch_size=3,
+        checkpoint=checkpoint) == count
+    assert db_songs().count() == 2 * count
+    assert open(checkpoint).read().strip() == str(count)
+
+    assert import_json(
+        'tests/data/songs.json', False, checkpoint=checkpoint) == 0
+    assert db_songs().count() == 2 * count
+
+
+def test_checkpoint_file(tmpdir):
+    """Checkpoint is replaced atomically and empty checkpoint is an error"""
+
+    checkpoint = tmpdir.join('import.checkpoint')
+    assert read_checkpoint(str(checkpoint)) == 0
+
+    write_checkpoint(str(checkpoint), 7)
+    assert read_checkpoint(str(checkpoint)) == 7
+    assert tmpdir.listdir() == [checkpoint]
+
+    checkpoint.write('')
+    with pytest.raises(ValueError):
+        read_checkpoint(str(checkpoint))
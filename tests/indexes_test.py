@@ -0,0 +1,91 @@
+"""Test the `anthology/indexes` module
+
+Each query shape used by `anthology.database` is explained and must not
+plan a collection scan. Shapes with a more selective index than the sort
+index must also scan that index. First page facets without search terms
+count all songs and are intentionally not tested.
+
+"""
+
+import pytest
+
+import anthology.database as db
+from anthology.indexes import collscans, used_indexes
+
+
+def assert_indexed(explain, field=None):
+    """Fail if explain output has collection scans in the winning plan or,
+    if `field` is given, winning plan does not scan index of the field"""
+    assert collscans(explain) == [], explain
+    if field is not None:
+        assert any(field in keys for keys in used_indexes(explain)), explain
+
+
+def explain_aggregate(pipeline):
+    """Return explain output for aggregation pipeline on songs"""
+    collection = db.db_songs()
+    return collection.database.command(
+        'aggregate', collection.name, pipeline=pipeline, explain=True)
+
+
+def test_collscans():
+    """Collection scans are found from winning plans only"""
+    explain = {'queryPlanner': {
+        'winningPlan': {'stage': 'LIMIT', 'inputStage': {
+            'stage': 'FETCH', 'inputStage': {
+                'stage': 'IXSCAN', 'keyPattern': {'trigrams': 1}}}},
+        'rejectedPlans': [
+            {'stage': 'COLLSCAN'},
+            {'stage': 'IXSCAN', 'keyPattern': {'_id': 1}}]}}
+    assert collscans(explain) == []
+    assert used_indexes(explain) == [{'trigrams': 1}]
+    assert collscans({'stages': [{'$cursor': {'stage': 'COLLSCAN'}}]}) == [
+        {'stage': 'COLLSCAN'}]
+
+
+@pytest.mark.parametrize('kwargs, field', [
+    ({}, '_id'),
+    ({'previous_id': '0' * 24}, '_id'),
+    ({'search_term': 'fastfinger'}, 'trigrams'),
+    ({'search_term': 'fastfinger', 'sort': 'level'}, 'trigrams'),
+    ({'sort': 'difficulty'}, 'difficulty'),
+    ({'sort': '-level', 'cursor': [9, db.ObjectId()]}, 'level'),
+    ({'sort': 'released', 'cursor': [None, db.ObjectId()]}, 'released'),
+])
+def test_songs_list_indexed(kwargs, field):
+    """Song list queries use indexes"""
+    kwargs.setdefault('previous_id', None)
+    assert_indexed(db.get_songs_list(limit=10, **kwargs).explain(), field)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'search_term': 'fastfinger'},
+    {'search_term': 'fastfinger', 'sort': '-difficulty'},
+])
+def test_faceted_indexed(kwargs):
+    """Faceted first page with partial word search uses trigram index"""
+    assert_indexed(
+        explain_aggregate(db.faceted_pipeline(10, **kwargs)), 'trigrams')
+
+
+@pytest.mark.text_index
+def test_search_word_indexed():
+    """Full word searches use text index"""
+    assert_indexed(db.get_songs_list(
+        previous_id=None, limit=10, search_word='the').explain(), '_fts')
+    assert_indexed(explain_aggregate(
+        db.relevance_pipeline(None, 10, 'the')), '_fts')
+    assert_indexed(explain_aggregate(
+        db.relevance_pipeline([1.0, db.ObjectId()], 10, 'the')), '_fts')
+    assert_indexed(explain_aggregate(
+        db.faceted_pipeline(10, search_word='the')), '_fts')
+
+
+def test_other_queries_indexed():
+    """Top rated, export and average queries use indexes"""
+    assert_indexed(db.get_top_rated(None, 10).explain(), 'rating_average')
+    assert_indexed(
+        db.get_top_rated([3.5, db.ObjectId()], 10).explain(),
+        'rating_average')
+    assert_indexed(db.export_songs(search_term='night').explain(), 'trigrams')
+    assert_indexed(explain_aggregate(db.average_pipeline(9)))
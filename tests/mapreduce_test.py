@@ -0,0 +1,66 @@
+"""Test the `anthology/mapreduce` module"""
+
+import anthology.database as db
+from anthology import mapreduce
+from anthology.aggregate import calculate_totals
+
+
+SONGS = (
+    '{"title": "a", "difficulty": 2, "level": 1}\n'
+    '{"title": "b", "difficulty": 4, "level": 1}\n'
+    '{"title": "c", "difficulty": 9, "level": 1}\n'
+    '{"title": "d", "difficulty": 5, "level": 21}\n')
+
+
+def test_map_reduce(tmpdir):
+    """Statistics are the same regardless of the number of processes"""
+
+    source = tmpdir.join('songs.json')
+    source.write(SONGS)
+
+    single = mapreduce.map_reduce(str(source), 0, len(SONGS), processes=1)
+    parallel = mapreduce.map_reduce(str(source), 0, len(SONGS), processes=3)
+
+    assert sorted(single) == sorted(parallel) == [1, 21]
+    assert single[1]['sum'] == parallel[1]['sum'] == '15'
+    assert single[21]['count'] == parallel[21]['count'] == 1
+
+
+def test_pool_engine(tmpdir):
+    """Pool engine gives the same totals as Luigi workflow"""
+
+    source = tmpdir.join('songs.json')
+    source.write(SONGS[:88])
+
+    calculate_totals(filename=str(source), chunks=2, engine='pool')
+    assert db.get_average_difficulty_fun(1)["average_difficulty"] == 3
+
+    source.write(SONGS[88:], mode='a')
+
+    calculate_totals(filename=str(source), chunks=2, engine='pool')
+    calculate_totals(filename=str(source), chunks=2, engine='pool')
+    assert db.get_average_difficulty_fun(1)["average_difficulty"] == 5
+    assert db.get_average_difficulty_fun(21)["average_difficulty"] == 5
+    assert db.get_average_difficulty_fun(None)["number_of_songs"] == 4
+
+
+def test_concurrent_upsert(tmpdir, monkeypatch):
+    """Levels inserted by other process with the same range are applied"""
+
+    source = tmpdir.join('songs.json')
+    source.write(SONGS)
+
+    original = mapreduce.totals_update
+
+    def _totals_update(filename, level, total, partial, end):
+        """Insert the same totals before our upsert"""
+        condition, update, upsert = original(
+            filename, level, total, partial, end)
+        db.db_averages().update_one(condition, update, upsert=upsert)
+        return condition, update, upsert
+
+    monkeypatch.setattr(mapreduce, 'totals_update', _totals_update)
+
+    calculate_totals(filename=str(source), engine='pool')
+    assert db.get_average_difficulty_fun(1)["number_of_songs"] == 3
+    assert db.get_average_difficulty_fun(None)["number_of_songs"] == 4
@@ -0,0 +1,58 @@
+"""Test the `anthology/metrics` module"""
+
+from anthology import metrics
+
+
+def test_histogram():
+    """Buckets are cumulative and labels are escaped"""
+
+    histogram = metrics.Histogram(
+        'test_seconds', 'Test', ('name',), buckets=(0.1, 1.0))
+    histogram.observe(('a"b',), 0.05)
+    histogram.observe(('a"b',), 0.5)
+    histogram.observe(('a"b',), 5)
+
+    lines = list(histogram.lines())
+    assert 'test_seconds_bucket{name="a\\"b",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{name="a\\"b",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{name="a\\"b",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{name="a\\"b"} 3' in lines
+
+
+def test_query():
+    """Database function is kept for cursors iterated after return"""
+
+    @metrics.query
+    def outer():
+        """Call other database function"""
+        inner()
+        return metrics.current_function()
+
+    @metrics.query
+    def inner():
+        """Return current function"""
+        return metrics.current_function()
+
+    assert inner() == 'inner'
+    assert outer() == 'outer'
+    assert metrics.current_function() == 'outer'
+
+
+def test_metrics_endpoint(client_fx):
+    """GET /metrics"""
+
+    metrics.clear()
+    client_fx.get('/songs?limit=2')
+
+    response = client_fx.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+    text = response.data.decode('utf-8')
+    assert ('anthology_request_seconds_count{endpoint="songlist",'
+            'method="GET",status="200"} 1') in text
+    assert ('anthology_mongo_command_seconds_count{'
+            'function="get_songs_list",command="find"} 1') in text
+    assert ('anthology_mongo_documents_returned_total{'
+            'function="get_songs_list",command="find"} 2') in text
+    assert 'anthology_cache_hit_ratio' in text
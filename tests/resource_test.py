@@ -0,0 +1,35 @@
+"""Test the `anthology/resource` module"""
+
+from flask_restful.reqparse import Argument
+
+from anthology.api import get_app
+from anthology.resource import ParameterResource
+
+CALLS = []
+
+
+def counted(value):
+    """Count argument conversions"""
+    CALLS.append(value)
+    return int(value)
+
+
+class Counted(ParameterResource):
+    """Resource with single counted parameter"""
+
+    arguments = [Argument('count', type=counted)]
+
+
+def test_args_parsed_once():
+    """Parser is shared by requests and arguments parsed once per request"""
+
+    del CALLS[:]
+
+    for value in ['1', '2']:
+        with get_app().test_request_context('/?count=%s' % value):
+            resource = Counted()
+            assert resource.args.count == int(value)
+            assert resource.args.count == int(value)
+
+    assert CALLS == ['1', '2']
+    assert Counted().request_parser() is Counted().request_parser()
@@ -0,0 +1,28 @@
+"""Test the `anthology/serializer` module"""
+
+from json import dumps
+
+from bson import ObjectId
+from flask_restful import marshal
+
+from anthology.api import get_app
+from anthology.database import db_songs
+from anthology.serializer import Serializer
+from anthology.songs.search import SONG_FIELDS, SONGLIST_FIELDS
+from anthology.songs.search import serialize_songlist
+
+
+def test_serializer_identical():
+    """Compiled serializer output is identical to `marshal` output"""
+
+    songs = list(db_songs().find())
+    songs.append({'_id': ObjectId(), 'rating_stats': {'count': 2}})
+
+    with get_app().test_request_context('/songs'):
+        expected = marshal({'data': songs, 'next': '/next'}, SONGLIST_FIELDS)
+        result = serialize_songlist(songs, '/next')
+        assert dumps(result) == dumps(expected)
+
+        song = {'_id': 'needs quoting?', 'difficulty': 'x1'}
+        assert Serializer({'rating_url': SONG_FIELDS['rating_url']}).one(
+            song) == marshal(song, {'rating_url': SONG_FIELDS['rating_url']})
@@ -0,0 +1,62 @@
+"""Test the `anthology/stats` module"""
+
+import pytest
+
+from anthology import stats
+
+
+def test_merge():
+    """Merged partials equal partial of all values"""
+
+    values = [2, 14.6, 15, 3.5, 7, 7, 9.25]
+    expected = stats.summary(stats.from_values(values))
+
+    result = stats.summary(stats.merge_all(
+        [stats.from_values(values[:3]), stats.empty(),
+         stats.from_values(values[3:])]))
+
+    assert result['count'] == 7
+    assert result['average'] == expected['average']
+    assert result['min'] == 2
+    assert result['max'] == 15
+    assert result['variance'] == pytest.approx(expected['variance'])
+    assert result['histogram'] == {
+        '2': 1, '3': 1, '7': 2, '9': 1, '14': 1, '15': 1}
+
+
+def test_exact_sum():
+    """Sum does not lose precision with many values"""
+
+    partial = stats.from_values([0.1] * 10)
+    assert stats.total(partial) == 1.0
+    assert stats.summary(partial)['average'] == 0.1
+
+    partial = stats.from_values([1e16, 1, -1e16])
+    assert stats.total(partial) == 1
+
+
+def test_summary():
+    """Variance is population variance"""
+
+    result = stats.summary(stats.from_values([2, 4, 4, 4, 5, 5, 7, 9]))
+    assert result['variance'] == pytest.approx(4)
+    assert result['stddev'] == pytest.approx(2)
+
+    assert stats.summary(stats.empty()) is None
+
+
+def test_accumulator():
+    """Accumulator gives the same partial as merging single values"""
+
+    accumulator = stats.Accumulator()
+    partial = stats.empty()
+    for value in [3, 1.5, 7]:
+        accumulator.add(value)
+        partial = stats.merge(partial, stats.from_values([value]))
+
+    result = accumulator.partial()
+    for key in ('count', 'sum', 'min', 'max', 'histogram'):
+        assert result[key] == partial[key]
+    assert result['mean'] == pytest.approx(partial['mean'])
+    assert result['m2'] == pytest.approx(partial['m2'])
+    assert result['sum'] == '23/2'
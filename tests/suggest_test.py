@@ -0,0 +1,87 @@
+"""Test the `anthology/suggest` module"""
+
+from bson import ObjectId
+
+from anthology.suggest import SuggestIndex, normalize
+
+
+def test_normalize():
+    """Case, accents and whitespace are normalized"""
+    assert normalize(u'  Beyonc\xe9   Knowles ') == u'beyonce knowles'
+    assert normalize('ABBA') == u'abba'
+
+
+def test_search():
+    """Words of titles and artists are matched by prefix"""
+
+    index = SuggestIndex()
+    first, second = ObjectId(), ObjectId()
+    index.add([
+        {'_id': first, 'title': 'Wishing In The Night',
+         'artist': 'The Yousicians'},
+        {'_id': second, 'title': 'Night Fever', 'artist': 'The Yousicians'}])
+
+    assert index.search('nig') == [
+        ('title', 'Wishing In The Night', str(first)),
+        ('title', 'Night Fever', str(second))]
+    assert index.search('YOU') == [('artist', 'The Yousicians', None)]
+    assert index.search('the', limit=2) == [
+        ('title', 'Wishing In The Night', str(first)),
+        ('artist', 'The Yousicians', None)]
+    assert index.search('the you') == [('artist', 'The Yousicians', None)]
+    assert index.search('the nig') == [
+        ('title', 'Wishing In The Night', str(first))]
+    assert index.search('the yousicians x') == []
+    assert index.search('in the n') == [
+        ('title', 'Wishing In The Night', str(first))]
+    assert index.search('x') == []
+    assert index.search(' ') == []
+    assert index.search('-') == []
+
+
+def test_refresh(monkeypatch):
+    """Changed songs are added, unknown changes load the index again"""
+
+    songs = [{'_id': ObjectId(), 'title': 'Night Fever'}]
+    changes = [(1, None)]
+    queries = []
+
+    def _song_names(ids=None):
+        """Return songs with given ids"""
+        queries.append(ids)
+        return [song for song in songs if ids is None or song['_id'] in ids]
+
+    monkeypatch.setattr(
+        'anthology.database.get_name_changes', lambda version: changes[0])
+    monkeypatch.setattr('anthology.database.get_song_names', _song_names)
+
+    clock = [0]
+    index = SuggestIndex(refresh_interval=5, clock=lambda: clock[0])
+    index.refresh()
+    assert len(index.search('n')) == 1
+
+    # Ids of songs inserted by other clients are not ordered
+    songs.insert(0, {'_id': ObjectId('0' * 24), 'title': 'Nightcall'})
+    songs[1] = dict(songs[1], title='Day Fever')
+    changes[0] = (2, [songs[0]['_id'], songs[1]['_id']])
+
+    clock[0] = 1
+    index.refresh()
+    assert len(index.search('n')) == 1
+
+    clock[0] = 6
+    index.refresh()
+    assert len(index.search('n')) == 2
+    assert len(index.search('day')) == 1
+    assert queries == [None, changes[0][1]]
+
+    clock[0] = 12
+    changes[0] = (2, [])
+    index.refresh()
+    assert len(queries) == 2
+
+    # Previous titles are dropped when the index is loaded again
+    clock[0] = 18
+    changes[0] = (3, None)
+    index.refresh()
+    assert [text for _, text, _ in index.search('n')] == ['Nightcall']
@@ -0,0 +1,23 @@
+"""Test the `anthology/trigrams` module"""
+
+from anthology.trigrams import trigrams, song_trigrams, term_query
+
+
+def test_trigrams():
+    """Trigrams are lowercased and short strings have none"""
+    assert trigrams('Waki') == set(['wak', 'aki'])
+    assert trigrams('me') == set()
+
+
+def test_song_trigrams():
+    """Song trigrams combine title and artist"""
+    song = {'title': 'Abcd', 'artist': 'Xyz', 'level': 1}
+    assert song_trigrams(song) == ['abc', 'bcd', 'xyz']
+
+
+def test_term_query():
+    """Only plain terms of three or more characters are narrowed"""
+    assert term_query('FastF') == {
+        'trigrams': {'$all': ['ast', 'fas', 'stf']}}
+    assert term_query('in') is None
+    assert term_query('wak.*') is None